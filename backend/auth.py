@@ -1,24 +1,52 @@
+import hashlib
 import os
-from datetime import datetime, timezone
-from typing import Annotated, Type
+import secrets
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Optional, Type
 from typing_extensions import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.requests import HTTPConnection
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import ExpiredSignatureError, JWTError, jwt
-from passlib.context import CryptContext
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import delete, insert, or_
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, SQLModel, select
 
 from backend import database as db
-from backend.entities import UserInDB, UserResponse
+from backend.cache import TTLCache
+from backend.entities import RefreshTokenInDB, UserInDB, UserResponse
+from backend.passwords import PasswordHasher, get_password_hasher, pwd_context
+from backend.response_cache import USERS_TAG, invalidate_on_commit
+from backend.revocation import revocations
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 access_token_duration = 3600  # seconds
+refresh_token_duration = int(os.environ.get("REFRESH_TOKEN_DURATION", default=30 * 24 * 3600))  # seconds
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 jwt_key = os.environ.get("JWT_KEY", default="insecure-jwt-key-for-dev")
 jwt_alg = "HS256"
 
+# ids of the users allowed to use operator routes, comma-separated; nobody by
+# default. Ids rather than usernames, since users choose their usernames
+admin_user_ids = frozenset(
+    int(user_id) for user_id in os.environ.get("ADMIN_USER_IDS", default="").split(",") if user_id.strip())
+
+bulk_registration_batch_size = int(os.environ.get("BULK_REGISTRATION_BATCH_SIZE", default=500))
+bulk_registration_max_users = 10_000
+# not a valid hash, so no password matches it; for users who sign in through SSO
+unusable_password = "!"
+
+# claims of tokens whose signature was already verified; an entry expires
+# with its token, so expired tokens are still rejected by jwt.decode
+claims_cache = TTLCache(
+    max_size=int(os.environ.get("CLAIMS_CACHE_SIZE", default=10_000)),
+    ttl=access_token_duration,
+    name="claims",
+)
+
 auth_router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 
@@ -31,12 +59,45 @@ class UserRegistration(SQLModel):
     password: str
 
 
+class BulkUserRegistration(SQLModel):
+    """A user to register without a password."""
+
+    username: str
+    email: str
+
+
+class BulkRegistration(BaseModel):
+    """Request model to register many users at once."""
+
+    users: list[BulkUserRegistration] = Field(max_length=bulk_registration_max_users)
+
+
+class BulkRegistrationResponse(BaseModel):
+    """Response model for bulk registration; duplicates were skipped."""
+
+    created: int
+    duplicates: list[dict]
+
+
 class AccessToken(BaseModel):
     """Response model for access token."""
 
     access_token: str
     token_type: str
     expires_in: int
+    refresh_token: Optional[str] = None
+
+
+class RefreshRequest(BaseModel):
+    """Request model to exchange a refresh token for a new access token."""
+
+    refresh_token: str
+
+
+class RevokeRequest(BaseModel):
+    """Request model to revoke the current access token and a refresh token."""
+
+    refresh_token: Optional[str] = None
 
 
 class Claims(BaseModel):
@@ -44,6 +105,7 @@ class Claims(BaseModel):
 
     sub: str  # id of user
     exp: int  # unix timestamp
+    jti: Optional[str] = None  # id of token, for revocation
 
 
 class AuthException(HTTPException):
@@ -57,6 +119,17 @@ class AuthException(HTTPException):
         )
 
 
+class NotAnAdmin(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=403,
+            detail={
+                "error": "insufficient_scope",
+                "error_description": "only admins can do this",
+            },
+        )
+
+
 class InvalidCredentials(AuthException):
     def __init__(self):
         super().__init__(
@@ -81,90 +154,329 @@ class ExpiredToken(AuthException):
         )
 
 
+class RevokedToken(AuthException):
+    def __init__(self):
+        super().__init__(
+            error="invalid_client",
+            description="revoked bearer token",
+        )
+
+
+class InvalidRefreshToken(AuthException):
+    def __init__(self):
+        super().__init__(
+            error="invalid_grant",
+            description="invalid or expired refresh token",
+        )
+
+
 # Any route that requires a bearer token should have get_current_user as a dependency. This is accomplished by
 # including the following parameter in the function signature.
 # user: UserInDB = Depends(get_current_user)
-def get_current_user(
+async def get_current_user(
         session: Session = Depends(db.get_session),
         token: str = Depends(oauth2_scheme),
 ) -> Type[UserInDB]:
     """FastAPI dependency to get current user from bearer token."""
-    user = _decode_access_token(session, token)
+    user = await db.run(session, _decode_access_token, token=token)
+    return user
+
+
+async def get_admin_user(user: UserInDB = Depends(get_current_user)) -> UserInDB:
+    """FastAPI dependency to get the current user, who must be listed in ADMIN_USER_IDS."""
+    if user.id not in admin_user_ids:
+        raise NotAnAdmin()
     return user
 
 
+def get_connection_user(session: Session, connection: HTTPConnection) -> Type[UserInDB]:
+    """
+    Authenticate a streaming connection (websocket or server-sent events).
+
+    Browsers cannot set headers on websocket or EventSource requests, so the
+    bearer token may also be passed as the `token` query parameter.
+
+    :raises AuthException: if the token is missing, invalid or expired
+    """
+    token = connection.query_params.get("token")
+    if token is None:
+        scheme, _, token = connection.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise InvalidToken()
+
+    return _decode_access_token(session, token)
+
+
 # AUTH ROUTES -----------------------------------------
 @auth_router.post(
     "/registration",
     response_model=UserResponse,
     status_code=201)
-def register_new_user(
+async def register_new_user(
         registration: UserRegistration,
         # session: Session = Depends(db.get_session),
         session: Annotated[Session, Depends(db.get_session)],
+        hasher: PasswordHasher = Depends(get_password_hasher),
 ):
     """Register new user."""
-    same_username = session.exec(select(UserInDB).where(
-        UserInDB.username == registration.username)).first()
-    if same_username:
-        detail = {
-            "type": "duplicate_value",
-            "entity_name": "User",
-            "entity_field": "username",
-            "entity_value": registration.username
-        }
-        raise HTTPException(status_code=422, detail=detail)
-
-    same_email = session.exec(select(UserInDB).where(
-        UserInDB.email == registration.email)).first()
-    if same_email:
-        detail = {
-            "type": "duplicate_value",
-            "entity_name": "User",
-            "entity_field": "email",
-            "entity_value": registration.email
-        }
-        raise HTTPException(status_code=422, detail=detail)
-
-    hashed_password = pwd_context.hash(registration.password)
-    user = UserInDB(
-        **registration.model_dump(),
-        hashed_password=hashed_password,
-    )
-    session.add(user)
-    session.commit()
-    session.refresh(user)
+    hashed_password = await hasher.hash(registration.password)
+    user = await db.run(
+        session, _create_user,
+        registration=registration, hashed_password=hashed_password)
     return UserResponse(user=user)
 
 
+@auth_router.post(
+    "/registration/bulk",
+    response_model=BulkRegistrationResponse,
+    status_code=200)
+async def register_users_in_bulk(
+        registration: BulkRegistration,
+        session: Session = Depends(db.get_session),
+        user: UserInDB = Depends(get_admin_user),
+):
+    """
+    Register users who sign in through SSO, in batched transactions.
+
+    Only admins can. The users get no password. Users whose username or
+    email is already taken are skipped and reported in `duplicates`.
+    """
+    created, duplicates = await db.run(
+        session, _create_users_in_bulk, registrations=registration.users)
+    return BulkRegistrationResponse(created=created, duplicates=duplicates)
+
+
 @auth_router.post(path="/token", response_model=AccessToken)
-def get_access_token(
+async def get_access_token(
         form: OAuth2PasswordRequestForm = Depends(),
         session: Session = Depends(db.get_session),
+        hasher: PasswordHasher = Depends(get_password_hasher),
 ):
     """Get access token for user."""
-    user = _get_authenticated_user(session, form)
-    return _build_access_token(user)
+    user = await db.run(session, _get_user_by_username, username=form.username)
+    if user is None or pwd_context.identify(user.hashed_password) is None:
+        raise InvalidCredentials()
+
+    valid, new_hash = await hasher.verify_and_update(form.password, user.hashed_password)
+    if not valid:
+        raise InvalidCredentials()
+    if new_hash is not None:
+        # the stored hash predates the current bcrypt settings
+        await db.run(session, _update_password_hash, user=user, hashed_password=new_hash)
+
+    access_token = _build_access_token(user)
+    access_token.refresh_token = await db.run(session, _create_refresh_token, user_id=user.id)
+    return access_token
 
 
-def _get_authenticated_user(
+@auth_router.post(path="/refresh", response_model=AccessToken)
+async def refresh_access_token(
+        refresh: RefreshRequest,
+        session: Session = Depends(db.get_session),
+):
+    """
+    Exchange a refresh token for a new access token, without the password.
+
+    The refresh token is single use: the response carries its replacement.
+    """
+    user, refresh_token = await db.run(
+        session, _rotate_refresh_token, refresh_token=refresh.refresh_token)
+
+    access_token = _build_access_token(user)
+    access_token.refresh_token = refresh_token
+    return access_token
+
+
+@auth_router.post(path="/revoke", status_code=204)
+async def revoke_tokens(
+        revoke: Optional[RevokeRequest] = None,
+        session: Session = Depends(db.get_session),
+        token: str = Depends(oauth2_scheme),
+):
+    """Revoke the bearer token, and the given refresh token of the same user."""
+    user = await db.run(session, _decode_access_token, token=token)
+    claims = _decode_claims(token)
+    if claims.jti is not None:
+        await db.run(session, revocations.revoke, jti=claims.jti, expires_at=claims.exp)
+    if revoke is not None and revoke.refresh_token is not None:
+        await db.run(
+            session, _delete_refresh_token,
+            refresh_token=revoke.refresh_token, user_id=user.id)
+
+
+def _duplicate_value(field: str, value: str) -> dict:
+    return {
+        "type": "duplicate_value",
+        "entity_name": "User",
+        "entity_field": field,
+        "entity_value": value,
+    }
+
+
+def _find_duplicates(session: Session, usernames: list[str], emails: list[str]) -> set[tuple[str, str]]:
+    """
+    Return the (field, value) pairs among usernames and emails that are taken.
+
+    One query, served by the unique indexes on both columns.
+    """
+    rows = session.exec(select(UserInDB.username, UserInDB.email).where(or_(
+        UserInDB.username.in_(usernames), UserInDB.email.in_(emails)))).all()
+    return {("username", username) for username, _ in rows} | \
+        {("email", email) for _, email in rows}
+
+
+def _create_user(
         session: Session,
-        form: OAuth2PasswordRequestForm,
+        registration: UserRegistration,
+        hashed_password: str,
 ) -> UserInDB:
-    user = session.exec(
-        select(UserInDB).where(UserInDB.username == form.username)
+    # the unique constraints decide, so concurrent registrations cannot race;
+    # which field clashed is only looked up after a conflict
+    user = UserInDB(
+        **registration.model_dump(),
+        hashed_password=hashed_password,
+    )
+    session.add(user)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        taken = _find_duplicates(session, [registration.username], [registration.email])
+        for field in ["username", "email"]:
+            value = getattr(registration, field)
+            if (field, value) in taken:
+                raise HTTPException(status_code=422, detail=_duplicate_value(field, value))
+        raise
+    session.refresh(user)
+    return user
+
+
+def _create_users_in_bulk(
+        session: Session,
+        registrations: list[BulkUserRegistration],
+        batch_size: Optional[int] = None,
+) -> tuple[int, list[dict]]:
+    """
+    Insert users with one multi-row INSERT and one transaction per batch.
+
+    A batch that violates a unique constraint is rolled back, its taken
+    usernames and emails are looked up, and the rest of the batch is retried.
+
+    :return: the number of users created, and the duplicate_value details of
+        the skipped ones
+    """
+    batch_size = batch_size or bulk_registration_batch_size
+    duplicates = []
+    rows = []
+    seen = set()
+    for registration in registrations:
+        clash = next((field for field in ["username", "email"]
+                      if (field, getattr(registration, field)) in seen), None)
+        if clash is not None:
+            duplicates.append(_duplicate_value(clash, getattr(registration, clash)))
+            continue
+        seen.update([("username", registration.username), ("email", registration.email)])
+        rows.append({
+            "username": registration.username,
+            "email": registration.email,
+            "hashed_password": unusable_password,
+            "created_at": datetime.now(),
+        })
+
+    created = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        while batch:
+            try:
+                session.execute(insert(UserInDB), batch)
+                invalidate_on_commit(session, USERS_TAG)
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                taken = _find_duplicates(
+                    session, [row["username"] for row in batch], [row["email"] for row in batch])
+                remaining = []
+                for row in batch:
+                    clash = next((field for field in ["username", "email"]
+                                  if (field, row[field]) in taken), None)
+                    if clash is None:
+                        remaining.append(row)
+                    else:
+                        duplicates.append(_duplicate_value(clash, row[clash]))
+                if len(remaining) == len(batch):
+                    raise
+                batch = remaining
+                continue
+            created += len(batch)
+            break
+
+    return created, duplicates
+
+
+def _update_password_hash(session: Session, user: UserInDB, hashed_password: str):
+    user.hashed_password = hashed_password
+    session.add(user)
+    session.commit()
+    db.principal_cache.invalidate(user.id)
+
+
+def _get_user_by_username(session: Session, username: str) -> Optional[UserInDB]:
+    return session.exec(
+        select(UserInDB).where(UserInDB.username == username)
     ).first()
 
-    if user is None or not pwd_context.verify(form.password, user.hashed_password):
-        raise InvalidCredentials()
 
-    return user
+def _hash_refresh_token(refresh_token: str) -> str:
+    # refresh tokens are random, so a fast hash is enough to keep the stored
+    # values useless to someone reading the table
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+def _create_refresh_token(session: Session, user_id: int, commit: bool = True) -> str:
+    # expired tokens nobody presented again are pruned at the same time
+    session.exec(delete(RefreshTokenInDB).where(RefreshTokenInDB.expires_at <= datetime.now()))
+    refresh_token = secrets.token_urlsafe(32)
+    session.add(RefreshTokenInDB(
+        user_id=user_id,
+        token_hash=_hash_refresh_token(refresh_token),
+        expires_at=datetime.now() + timedelta(seconds=refresh_token_duration),
+    ))
+    if commit:
+        session.commit()
+    return refresh_token
+
+
+def _rotate_refresh_token(session: Session, refresh_token: str) -> tuple[UserInDB, str]:
+    # the token is used up by deleting it: of two concurrent requests
+    # presenting it, only the one whose DELETE returns the row goes on
+    used = session.execute(
+        delete(RefreshTokenInDB)
+        .where(RefreshTokenInDB.token_hash == _hash_refresh_token(refresh_token))
+        .returning(RefreshTokenInDB.user_id, RefreshTokenInDB.expires_at)
+    ).first()
+    user = session.get(UserInDB, used.user_id) if used is not None else None
+    if user is None or used.expires_at <= datetime.now():
+        session.commit()
+        raise InvalidRefreshToken()
+
+    new_refresh_token = _create_refresh_token(session, user_id=user.id, commit=False)
+    session.commit()
+    return user, new_refresh_token
+
+
+def _delete_refresh_token(session: Session, refresh_token: str, user_id: int):
+    stored = session.exec(select(RefreshTokenInDB).where(
+        RefreshTokenInDB.token_hash == _hash_refresh_token(refresh_token),
+        RefreshTokenInDB.user_id == user_id)).first()
+    if stored is not None:
+        session.delete(stored)
+        session.commit()
 
 
 def _build_access_token(user: UserInDB) -> AccessToken:
     expiration = int(datetime.now(timezone.utc).timestamp()) + \
         access_token_duration
-    claims = Claims(sub=str(user.id), exp=expiration)
+    claims = Claims(sub=str(user.id), exp=expiration, jti=uuid.uuid4().hex)
     access_token = jwt.encode(
         claims.model_dump(), key=jwt_key, algorithm=jwt_alg)
 
@@ -175,20 +487,33 @@ def _build_access_token(user: UserInDB) -> AccessToken:
     )
 
 
-def _decode_access_token(session: Session, token: str) -> Type[UserInDB]:
-    try:
-        claims_dict = jwt.decode(token, key=jwt_key, algorithms=[jwt_alg])
-        claims = Claims(**claims_dict)
-        user_id = claims.sub
-        user = session.get(UserInDB, user_id)
+def _decode_claims(token: str) -> Claims:
+    # keyed by the whole token, not only its signature segment, so a cached
+    # entry can only be reached with the exact token that was verified
+    claims = claims_cache.get(token)
+    if claims is None:
+        claims = Claims(**jwt.decode(token, key=jwt_key, algorithms=[jwt_alg]))
+        claims_cache.set(token, claims, ttl=claims.exp - time.time())
+
+    return claims
 
-        if user is None:
-            raise InvalidToken()
 
-        return user
+def _decode_access_token(session: Session, token: str) -> Type[UserInDB]:
+    try:
+        claims = _decode_claims(token)
+        user_id = int(claims.sub)
     except ExpiredSignatureError:
         raise ExpiredToken()
-    except JWTError:
+    except (JWTError, ValidationError, ValueError):
         raise InvalidToken()
-    except ValidationError():
+
+    # a query at most once per sync interval, not per request
+    revocations.sync_if_due(session)
+    if revocations.is_revoked(claims.jti):
+        raise RevokedToken()
+
+    user = db.get_principal(user_id, session)
+    if user is None:
         raise InvalidToken()
+
+    return user
@@ -0,0 +1,176 @@
+"""Bounded in-process caches with per-entry expiry."""
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+# named caches, reported by GET /admin/caches
+caches: dict[str, Any] = {}
+
+
+class CacheBackend(ABC):
+    """
+    Storage of a cache: TTLCache in process, or an external store shared by workers.
+
+    `generation` must increase on every invalidation (across every process
+    sharing the store), so that a value loaded before a concurrent
+    invalidation can be refused with `set(..., generation=...)` instead of
+    re-caching stale data. Entries can be tagged, eg with the ids of the
+    rows they were built from, and `invalidate_tags` drops every entry
+    carrying any of the given tags.
+    """
+
+    generation: int
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if it is missing or expired."""
+
+    @abstractmethod
+    def set(
+            self,
+            key: Hashable,
+            value: Any,
+            ttl: Optional[float] = None,
+            generation: Optional[int] = None,
+            tags: Iterable[str] = (),
+    ):
+        """Cache value under key, unless something was invalidated since `generation`."""
+
+    @abstractmethod
+    def invalidate(self, key: Hashable):
+        """Drop the entry of key."""
+
+    @abstractmethod
+    def invalidate_tags(self, tags: Iterable[str]):
+        """Drop every entry tagged with any of tags."""
+
+    @abstractmethod
+    def clear(self):
+        """Drop every entry."""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Size and hit statistics, as reported by GET /admin/caches."""
+
+
+class TTLCache(CacheBackend):
+    """
+    Thread-safe LRU cache whose entries also expire after a time to live.
+
+    At most `max_size` entries are kept; inserting beyond that evicts the least
+    recently used one. `generation` increases on every invalidation, so that a
+    value loaded before a concurrent invalidation can be refused with
+    `set(..., generation=...)` instead of re-caching stale data.
+    """
+
+    def __init__(
+            self,
+            max_size: int,
+            ttl: float,
+            name: Optional[str] = None,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[float, Any, frozenset[str]]] = OrderedDict()
+        self._tagged: dict[str, set[Hashable]] = {}
+        if name is not None:
+            caches[name] = self
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(
+            self,
+            key: Hashable,
+            value: Any,
+            ttl: Optional[float] = None,
+            generation: Optional[int] = None,
+            tags: Iterable[str] = (),
+    ):
+        """
+        Cache value under key.
+
+        :param ttl: time to live of this entry, instead of the cache's default
+        :param generation: only cache the value if nothing was invalidated
+            since `generation` was read
+        :param tags: tags of the entry, for `invalidate_tags`
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (self.clock() + ttl, value, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        # the caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tagged[tag]
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self.generation += 1
+            self._remove(key)
+
+    def invalidate_tags(self, tags: Iterable[str]):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._tagged.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tagged.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,202 @@
+"""Denormalized chat counters: message_count, user_count, last_message_at and version.
+
+The counters on `chats` are kept up to date in the transaction that changes
+what they count: a session listener turns the messages and memberships added
+or deleted through the ORM into `UPDATE chats SET message_count =
+message_count + n ...` statements during the same flush, and code inserting
+rows without the ORM (bulk inserts) calls `increment_chat_counters` itself.
+Incrementing in SQL keeps concurrent writers from losing updates.
+
+`version` is bumped along with the other counters, and also when a chat is
+renamed or changes owner, and when one of its members, its owner or the
+author of one of its messages changes their username or email: whenever
+`GET /chats/{chat_id}` and its messages and users could change.
+
+Anything that bypasses both (manual SQL, restored backups) makes the counters
+drift; `reconcile_chat_counters` recomputes them, and can be run with
+
+    python -m backend.counters
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional, Union
+
+from sqlalchemy import Connection, case, event, func, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from backend.entities import ChatInDB, MessageInDB, UserChatLinkInDB, UserInDB
+
+chats_table = ChatInDB.__table__
+messages_table = MessageInDB.__table__
+links_table = UserChatLinkInDB.__table__
+
+counter_columns = ["message_count", "user_count", "last_message_at", "version"]
+
+# changing these changes the responses of the chats the row appears in
+chat_fields = ["name", "owner_id"]
+user_fields = ["username", "email"]
+
+
+def increment_chat_counters(
+        connection: Union[Connection, Session],
+        chat_id: int,
+        messages: int = 0,
+        users: int = 0,
+        last_message_at: Optional[datetime] = None,
+):
+    """
+    Add to the counters of a chat and bump its version, in the caller's transaction.
+
+    :param connection: connection or session of the transaction
+    :param chat_id: id of the chat
+    :param messages: number of messages added (negative if deleted)
+    :param users: number of members added (negative if removed)
+    :param last_message_at: creation time of the newest added message
+    """
+    values = {
+        "message_count": chats_table.c.message_count + messages,
+        "user_count": chats_table.c.user_count + users,
+        "version": chats_table.c.version + 1,
+    }
+    if last_message_at is not None:
+        values["last_message_at"] = case(
+            (or_(chats_table.c.last_message_at.is_(None),
+                 chats_table.c.last_message_at < last_message_at), last_message_at),
+            else_=chats_table.c.last_message_at,
+        )
+    connection.execute(chats_table.update().where(chats_table.c.id == chat_id).values(values))
+
+
+def reconcile_chat_counters(connection: Union[Connection, Session]) -> int:
+    """
+    Recompute the counters of every chat from the messages and members.
+
+    :param connection: connection or session; the caller commits
+    :return: the number of chats whose counters had drifted
+    """
+    message_count = select(func.count()).where(
+        messages_table.c.chat_id == chats_table.c.id).scalar_subquery()
+    last_message_at = select(func.max(messages_table.c.created_at)).where(
+        messages_table.c.chat_id == chats_table.c.id).scalar_subquery()
+    user_count = select(func.count()).where(
+        links_table.c.chat_id == chats_table.c.id).scalar_subquery()
+
+    result = connection.execute(
+        chats_table.update()
+        .where(or_(
+            chats_table.c.message_count != message_count,
+            chats_table.c.user_count != user_count,
+            chats_table.c.last_message_at.is_distinct_from(last_message_at),
+        ))
+        .values(
+            message_count=message_count,
+            user_count=user_count,
+            last_message_at=last_message_at,
+            # the responses change with the counters, so their ETags must too
+            version=chats_table.c.version + 1,
+        )
+    )
+    return result.rowcount
+
+
+@event.listens_for(Session, "after_flush")
+def _update_chat_counters(session: Session, flush_context):
+    # runs after the rows are written (so new ids are known) but while
+    # session.new, session.deleted and attribute histories still describe
+    # what the flush changed
+    messages = defaultdict(int)
+    last_message_at = {}
+    users = defaultdict(int)
+    memberships = {}  # (user, chat) -> +1 or -1, seen from either side
+
+    for obj in session.new:
+        if isinstance(obj, MessageInDB):
+            messages[obj.chat_id] += 1
+            if obj.created_at is not None:
+                latest = last_message_at.get(obj.chat_id, obj.created_at)
+                last_message_at[obj.chat_id] = max(latest, obj.created_at)
+        elif isinstance(obj, UserChatLinkInDB):
+            users[obj.chat_id] += 1
+    for obj in session.deleted:
+        if isinstance(obj, MessageInDB):
+            messages[obj.chat_id] -= 1
+        elif isinstance(obj, UserChatLinkInDB):
+            users[obj.chat_id] -= 1
+
+    for obj in session.new | session.dirty:
+        if isinstance(obj, ChatInDB):
+            history = inspect(obj).attrs.users.history
+            for user in history.added or ():
+                memberships[(id(user), id(obj))] = (obj, 1)
+            for user in history.deleted or ():
+                memberships[(id(user), id(obj))] = (obj, -1)
+        elif isinstance(obj, UserInDB):
+            history = inspect(obj).attrs.chats.history
+            for chat in history.added or ():
+                memberships[(id(obj), id(chat))] = (chat, 1)
+            for chat in history.deleted or ():
+                memberships[(id(obj), id(chat))] = (chat, -1)
+    for chat, delta in memberships.values():
+        if chat not in session.deleted:
+            users[chat.id] += delta
+
+    # a membership swap leaves the counts alone but still changes the chat
+    changed = set(messages.keys() | users.keys())
+    edited_users = set()
+    for obj in session.dirty:
+        if isinstance(obj, ChatInDB) and _has_changes(obj, chat_fields):
+            changed.add(obj.id)
+        elif isinstance(obj, UserInDB) and _has_changes(obj, user_fields):
+            edited_users.add(obj.id)
+    changed.discard(None)
+
+    for chat_id in changed:
+        increment_chat_counters(
+            session, chat_id,
+            messages=messages[chat_id],
+            users=users[chat_id],
+            last_message_at=last_message_at.get(chat_id),
+        )
+
+    if edited_users:
+        changed.update(_bump_chat_versions_of_users(session, edited_users))
+
+    session.info.setdefault("changed_chat_counters", set()).update(changed)
+
+
+def _has_changes(obj, fields: list[str]) -> bool:
+    attrs = inspect(obj).attrs
+    return any(attrs[field].history.has_changes() for field in fields)
+
+
+def _bump_chat_versions_of_users(session: Session, user_ids: set[int]) -> list[int]:
+    # users appear in the chats they own, are members of or wrote messages in
+    result = session.execute(
+        chats_table.update()
+        .where(or_(
+            chats_table.c.owner_id.in_(user_ids),
+            chats_table.c.id.in_(select(links_table.c.chat_id).where(links_table.c.user_id.in_(user_ids))),
+            chats_table.c.id.in_(select(messages_table.c.chat_id).where(messages_table.c.user_id.in_(user_ids))),
+        ))
+        .values(version=chats_table.c.version + 1)
+        .returning(chats_table.c.id)
+    )
+    return list(result.scalars())
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _expire_chat_counters(session: Session, flush_context):
+    # loaded chats would otherwise keep showing the old counts
+    changed = session.info.pop("changed_chat_counters", None)
+    if not changed:
+        return
+    for chat in list(session.identity_map.values()):
+        if isinstance(chat, ChatInDB) and chat.id in changed:
+            session.expire(chat, counter_columns)
+
+
+if __name__ == "__main__":
+    from backend.database import engine
+
+    with engine.begin() as connection:
+        print(f"repaired the counters of {reconcile_chat_counters(connection)} chats")
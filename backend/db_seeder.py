@@ -4,9 +4,9 @@ from sqlalchemy import func
 from sqlmodel import Session, create_engine, select
 
 from backend.entities import *
-from backend.database import engine
+from backend.database import create_db_and_tables, engine
 
-SQLModel.metadata.create_all(engine)
+create_db_and_tables()
 
 local_engine = create_engine(
     "sqlite:///backend/initial.db",
@@ -64,7 +64,11 @@ def add_users() -> dict[str, int]:
 
 def add_chats() -> dict[str, int]:
     with Session(local_engine) as local_session:
-        chats = local_session.exec(select(ChatInDB)).all()
+        # the initial database predates the chat counters, which are
+        # maintained as the messages and members are added
+        rows = local_session.exec(select(
+            ChatInDB.id, ChatInDB.name, ChatInDB.owner_id, ChatInDB.created_at)).all()
+        chats = [ChatInDB(**row._mapping) for row in rows]
         local_count = len(chats)
 
     with Session(engine) as session:
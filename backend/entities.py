@@ -1,6 +1,7 @@
 from datetime import date, datetime
 from pydantic import BaseModel, Field
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -12,6 +13,10 @@ class UserChatLinkInDB(SQLModel, table=True):
     """Database model for many-to-many relation of users to chats."""
 
     __tablename__ = "user_chat_links"
+    # the primary key covers (user_id, chat_id); this covers chat -> users
+    __table_args__ = (
+        Index("ix_user_chat_links_chat_id_user_id", "chat_id", "user_id"),
+    )
 
     user_id: int = Field(foreign_key="users.id", primary_key=True)
     chat_id: int = Field(foreign_key="chats.id", primary_key=True)
@@ -40,26 +45,43 @@ class ChatInDB(SQLModel, table=True):
     __tablename__ = "chats"
 
     id: Optional[int] = Field(default=None, primary_key=True)
-    name: str
-    owner_id: int = Field(foreign_key="users.id")
+    name: str = Field(index=True)
+    owner_id: int = Field(foreign_key="users.id", index=True)
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    # maintained by backend.counters, so metadata needs no COUNT over the chat
+    message_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    user_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    last_message_at: Optional[datetime] = None
+    # bumped by backend.counters on every change shown by the chat's
+    # responses, which makes it their ETag
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     owner: UserInDB = Relationship()
+    # ordered in SQL whenever the collections are loaded
     users: list[UserInDB] = Relationship(
         back_populates="chats",
         link_model=UserChatLinkInDB,
+        sa_relationship_kwargs={"order_by": "UserInDB.id"},
+    )
+    messages: list["MessageInDB"] = Relationship(
+        back_populates="chat",
+        sa_relationship_kwargs={"order_by": "[MessageInDB.created_at, MessageInDB.id]"},
     )
-    messages: list["MessageInDB"] = Relationship(back_populates="chat")
 
 
 class MessageInDB(SQLModel, table=True):
     """Database model for message."""
 
     __tablename__ = "messages"
+    # backs chat timelines ordered by (created_at, id)
+    __table_args__ = (
+        Index("ix_messages_chat_id_created_at_id",
+              "chat_id", "created_at", "id"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     text: str
-    user_id: int = Field(foreign_key="users.id")
+    user_id: int = Field(foreign_key="users.id", index=True)
     chat_id: int = Field(foreign_key="chats.id")
     created_at: Optional[datetime] = Field(default_factory=datetime.now)
 
@@ -67,6 +89,40 @@ class MessageInDB(SQLModel, table=True):
     chat: ChatInDB = Relationship(back_populates="messages")
 
 
+class ChatReadCursorInDB(SQLModel, table=True):
+    """Database model for the last message a user has read in a chat."""
+
+    __tablename__ = "chat_read_cursors"
+
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    chat_id: int = Field(foreign_key="chats.id", primary_key=True)
+    last_read_message_id: int
+    updated_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+
+class RefreshTokenInDB(SQLModel, table=True):
+    """Database model for refresh token; only a hash of the token is stored."""
+
+    __tablename__ = "refresh_tokens"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="users.id", index=True)
+    token_hash: str = Field(unique=True)
+    expires_at: datetime = Field(index=True)
+    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+
+    user: UserInDB = Relationship()
+
+
+class RevokedTokenInDB(SQLModel, table=True):
+    """Database model for revoked access token, kept until the token expires."""
+
+    __tablename__ = "revoked_tokens"
+
+    jti: str = Field(primary_key=True)
+    expires_at: int = Field(index=True)  # unix timestamp, as the exp claim
+
+
 # ------------------------------------- #
 #            request models             #
 # ------------------------------------- #
@@ -79,6 +135,18 @@ class Metadata(BaseModel):
     count: int
 
 
+class CursorMetadata(Metadata):
+    """Represents metadata for a page of a collection paged by cursor."""
+
+    next_cursor: Optional[str] = None
+
+
+class OffsetMetadata(Metadata):
+    """Represents metadata for a page of a collection paged by offset."""
+
+    next_offset: Optional[int] = None
+
+
 class ChatMetaData(BaseModel):
     message_count: int
     user_count: int
@@ -130,11 +198,20 @@ class UserResponse(BaseModel):
     user: User
 
 
+class UserFields(SQLModel):
+    """A user with only the fields requested by a `fields` projection."""
+
+    id: Optional[int] = None
+    username: Optional[str] = None
+    email: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+
 class UserCollection(BaseModel):
     """Represents an API response for a collection of users."""
 
-    meta: Metadata
-    users: list[User]
+    meta: OffsetMetadata
+    users: list[UserFields]
 
 
 # messages-----------
@@ -152,6 +229,27 @@ class MessageCollection(BaseModel):
     messages: list[Message]
 
 
+class MessagePage(BaseModel):
+    """Represents an API response for a page of the messages in a chat."""
+
+    meta: CursorMetadata
+    messages: list[Message]
+
+
+class MessageSearchResult(Message):
+    """A message matching a search, with the matching words highlighted."""
+
+    score: float
+    highlight: str
+
+
+class MessageSearchResponse(BaseModel):
+    """Represents an API response for a message search."""
+
+    meta: OffsetMetadata
+    messages: list[MessageSearchResult]
+
+
 class MessageResponse(BaseModel):
     message: Message
 
@@ -189,13 +287,35 @@ class ChatByIDResponse(BaseModel):
     users: Optional[list[User]] = None
 
 
+class ChatSummary(Chat):
+    """A chat in a user's chat list, with a preview of its latest message."""
+
+    last_message: Optional[Message] = None
+    unread_count: Optional[int] = None
+
+
 class ChatsForUserResponse(BaseModel):
     """Represents an API response for chats for user"""
 
     meta: Metadata
-    chats: list[Chat]
+    chats: list[ChatSummary]
+
+
+class ReadCursorUpdate(SQLModel):
+    """Represents the last message the current user has read in a chat."""
+
+    message_id: int
+
+
+class ChatFields(SQLModel):
+    """A chat with only the fields requested by a `fields` projection."""
+
+    id: Optional[int] = None
+    name: Optional[str] = None
+    owner: Optional[User] = None
+    created_at: Optional[datetime] = None
 
 
 class ChatCollection(BaseModel):
-    meta: Metadata
-    chats: list[Chat]
+    meta: OffsetMetadata
+    chats: list[ChatFields]
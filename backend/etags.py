@@ -0,0 +1,61 @@
+"""Conditional GETs of chat resources.
+
+`GET /chats/{chat_id}` and its messages and users answer with a weak ETag
+built from the chat's version (see backend.counters), which is read with a
+single primary key lookup. A request whose If-None-Match matches it gets an
+empty 304 without loading the chat, its messages or its members.
+"""
+from typing import Callable, Optional
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlmodel import Session
+
+from backend import database as db
+
+# the chat and its messages change with every new message, so clients
+# revalidate them on every use; member lists may be a few seconds stale
+chat_cache_control = "private, no-cache"
+messages_cache_control = "private, no-cache"
+users_cache_control = "private, max-age=10"
+
+
+def chat_etag(chat_id: int, version: int) -> str:
+    return f'W/"chat-{chat_id}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an ETag with the value of an If-None-Match header."""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def conditional_chat(cache_control: str) -> Callable:
+    """
+    Build a dependency making a chat route conditional.
+
+    The dependency sets the ETag and Cache-Control headers of the response,
+    and answers 304 Not Modified right away if the request's If-None-Match
+    matches. It reads the version before the route loads anything, so the
+    ETag is never newer than the data it is sent with.
+
+    :param cache_control: the Cache-Control policy of the route
+    """
+
+    async def dependency(
+            chat_id: int,
+            request: Request,
+            response: Response,
+            session: Session = Depends(db.get_session),
+    ) -> str:
+        version = await db.run(session, db.get_chat_version, chat_id)
+        headers = {"ETag": chat_etag(chat_id, version), "Cache-Control": cache_control}
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return headers["ETag"]
+
+    return dependency
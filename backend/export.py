@@ -0,0 +1,126 @@
+"""Streaming exports of a chat's full history.
+
+`GET /chats/{chat_id}/messages/export` writes every message of a chat,
+oldest first, as newline-delimited JSON (one `Message` object per line) or
+as CSV. The messages are read in batches of `export_batch_size` rows (see
+`database.stream`) and each batch is encoded and sent before the next is
+read, so a worker's memory does not grow with the size of the chat.
+
+Clients sending `Accept-Encoding: gzip` get the stream gzipped as it goes.
+The compression is done here rather than by a middleware, which would buffer
+every streamed response, server-sent events included.
+"""
+import csv
+import io
+import os
+import zlib
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, Optional, Sequence, Union
+
+from fastapi import HTTPException
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import database as db
+from backend.json_responses import render
+
+export_batch_size = int(os.environ.get("EXPORT_BATCH_SIZE", default=1000))
+export_gzip_level = int(os.environ.get("EXPORT_GZIP_LEVEL", default=6))
+
+export_media_types = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",  # starlette adds the charset
+}
+csv_columns = ["id", "chat_id", "created_at", "user_id", "username", "email", "text"]
+
+
+def export_media_type(export_format: str) -> str:
+    """
+    The media type of an export format.
+
+    :raises HTTPException: if the format is not one of export_media_types
+    """
+    if export_format not in export_media_types:
+        detail = {
+            "type": "invalid_format",
+            "format": export_format,
+            "allowed_formats": list(export_media_types),
+        }
+        raise HTTPException(status_code=422, detail=detail)
+    return export_media_types[export_format]
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip, by name or as *, with a non-zero q."""
+    qualities = {}
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        quality = params.strip().removeprefix("q=").strip() or "1"
+        try:
+            qualities[name.strip().lower()] = float(quality)
+        except ValueError:
+            continue
+    quality = qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0)))
+    return quality > 0
+
+
+def ndjson_batch(rows: Sequence) -> bytes:
+    """Encode rows of `database.message_rows_select` as JSON lines."""
+    return b"".join(render(db.message_dict(row)) + b"\n" for row in rows)
+
+
+def csv_header() -> bytes:
+    return csv_batch([], header=True)
+
+
+def csv_batch(rows: Sequence, header: bool = False) -> bytes:
+    """Encode rows of `database.message_rows_select` as CSV lines."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(csv_columns)
+    writer.writerows(
+        (message_id, chat_id, created_at.isoformat(), user_id, username, email, text)
+        for message_id, text, chat_id, created_at, user_id, username, email, _ in rows
+    )
+    return buffer.getvalue().encode()
+
+
+async def export_stream(
+        session: Union[Session, AsyncSession],
+        stmt,
+        export_format: str,
+        batch_size: int = export_batch_size,
+) -> AsyncIterator[bytes]:
+    """
+    Yield an export of the rows of stmt, one chunk per batch of rows.
+
+    :param session: the request's session; closed when the stream ends
+    :param stmt: a select from `database.message_export_statement`
+    :param export_format: "ndjson" or "csv"
+    :param batch_size: number of rows read and encoded at a time
+    """
+    try:
+        if export_format == "csv":
+            yield csv_header()
+        encode = csv_batch if export_format == "csv" else ndjson_batch
+        async with aclosing(db.stream(session, stmt, batch_size)) as batches:
+            async for rows in batches:
+                yield encode(rows)
+    finally:
+        # don't hold a database connection after the stream is done
+        await db.close(session)
+
+
+async def gzip_stream(chunks: AsyncGenerator[bytes, None], level: int = export_gzip_level) -> AsyncIterator[bytes]:
+    """Gzip a stream of chunks as they come, without buffering the whole of it."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        async for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        # when the client goes away, release the export's connection now
+        await chunks.aclose()
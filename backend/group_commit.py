@@ -0,0 +1,160 @@
+"""Write-behind buffer that commits new messages in groups.
+
+Every commit is an fsync on SQLite (and a round trip over NFS on EFS), so
+under a burst of messages the commits, not the inserts, are the bottleneck.
+With GROUP_COMMIT=1, `POST /chats/{chat_id}/messages` hands its message to a
+MessageWriter instead: a background thread collects messages for up to
+GROUP_COMMIT_INTERVAL_MS after the first one (or until GROUP_COMMIT_MAX_BATCH
+are waiting) and inserts them in one transaction. Each request waits for the
+commit that contains its message, so a 201 still means the message is stored
+and the response carries its id.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Engine, insert
+from sqlmodel import Session
+
+from backend import database as db
+from backend.counters import increment_chat_counters
+from backend.entities import MessageInDB, UserInDB
+from backend.metrics import Histogram
+
+group_commit_enabled = os.environ.get("GROUP_COMMIT") == "1"
+group_commit_interval_ms = float(os.environ.get("GROUP_COMMIT_INTERVAL_MS", default=5))
+group_commit_max_batch = int(os.environ.get("GROUP_COMMIT_MAX_BATCH", default=100))
+
+
+class MessageWriter:
+    """Inserts queued messages from a background thread, one transaction per flush."""
+
+    def __init__(
+            self,
+            engine: Engine,
+            interval_ms: float = group_commit_interval_ms,
+            max_batch: int = group_commit_max_batch,
+    ):
+        self.engine = engine
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+        self.flush_size = Histogram([1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+        self.flush_ms = Histogram([1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+        self.wait_ms = Histogram([1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+        self._queue: queue.Queue[Optional[tuple[dict, Future]]] = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    async def write(self, chat_id: int, text: str, user: UserInDB) -> MessageInDB:
+        """
+        Queue a message and wait until it is committed.
+
+        :return: the stored message, with its author set
+        :raises Exception: whatever inserting the message raised
+        """
+        self._start()
+        row = {"text": text, "user_id": user.id, "chat_id": chat_id, "created_at": datetime.now()}
+        future = Future()
+        start = time.perf_counter()
+        self._queue.put((row, future))
+        message_id = await asyncio.wrap_future(future)
+        self.wait_ms.observe(1000 * (time.perf_counter() - start))
+        return MessageInDB(id=message_id, user=user, **row)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def close(self):
+        """Flush the queued messages and stop the background thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.interval_ms / 1000
+            stop = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, batch: list[tuple[dict, Future]]):
+        # messages of requests that went away before the flush are not written
+        batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            ids = self._insert([row for row, _ in batch])
+        except Exception:
+            # one bad message (eg its chat was just deleted) must not fail
+            # the others, so retry them one transaction each
+            for row, future in batch:
+                try:
+                    future.set_result(self._insert([row])[0])
+                except Exception as e:
+                    future.set_exception(e)
+        else:
+            for (_, future), message_id in zip(batch, ids):
+                future.set_result(message_id)
+        self.flush_size.observe(len(batch))
+        self.flush_ms.observe(1000 * (time.perf_counter() - start))
+
+    def _insert(self, rows: list[dict]) -> list[int]:
+        with Session(self.engine) as session:
+            # a single statement assigns increasing ids in the order of its rows
+            ids = sorted(session.scalars(
+                insert(MessageInDB).values(rows).returning(MessageInDB.id)).all())
+            for chat_id in {row["chat_id"] for row in rows}:
+                chat_rows = [row for row in rows if row["chat_id"] == chat_id]
+                increment_chat_counters(
+                    session, chat_id, messages=len(chat_rows),
+                    last_message_at=max(row["created_at"] for row in chat_rows))
+            session.commit()
+        return ids
+
+    def stats(self) -> dict:
+        return {
+            "interval_ms": self.interval_ms,
+            "max_batch": self.max_batch,
+            "queued": self._queue.qsize(),
+            "flush_size": self.flush_size.snapshot(),
+            "flush_ms": self.flush_ms.snapshot(),
+            "wait_ms": self.wait_ms.snapshot(),
+        }
+
+
+message_writer = MessageWriter(db.engine) if group_commit_enabled else None
+
+
+def get_message_writer() -> Optional[MessageWriter]:
+    """FastAPI dependency to get the message writer; None unless GROUP_COMMIT=1."""
+    return message_writer
@@ -0,0 +1,36 @@
+"""Fast JSON path for large collection responses.
+
+A route returning a response model has every row of the page hydrated into
+an ORM object (and registered in the session's identity map), validated into
+the model and then serialized by pydantic. For `GET /users` and
+`GET /chats/{chat_id}/messages`, which return up to 1000 rows, the database
+accessors instead select plain columns and build dicts straight from the
+result tuples, with the keys of the response model in its order, and the
+routes render them with orjson.
+
+The output is the same as the response model's: same keys, same order, same
+ISO 8601 datetimes. The routes keep their `response_model` for the OpenAPI
+schema, but FastAPI does not validate a Response returned as is, so the
+tests check the rendered bodies against the models.
+"""
+from typing import Any, Mapping, Optional
+
+import orjson
+from fastapi import Response
+
+
+def render(content: Any) -> bytes:
+    """Serialize dicts, lists, strings, numbers and datetimes to JSON."""
+    return orjson.dumps(content)
+
+
+def json_response(body: bytes, headers: Optional[Mapping[str, str]] = None) -> Response:
+    """
+    Wrap a body rendered by `render` in a response.
+
+    :param body: the JSON body
+    :param headers: extra headers, eg those dependencies set on the route's
+        `response` parameter, which FastAPI drops when a route returns a
+        Response itself
+    """
+    return Response(body, media_type="application/json", headers=headers)
@@ -5,11 +5,14 @@ from starlette.responses import HTMLResponse
 
 from backend.routers.chats import chats_router
 from backend.routers.users import users_router
+from backend.routers.admin import admin_router
+from backend.routers.search import search_router
 from backend.auth import auth_router
 from backend.database import EntityNotFoundException
 
 from contextlib import asynccontextmanager
 from backend.database import create_db_and_tables
+from backend.group_commit import get_message_writer
 
 from mangum import Mangum
 
@@ -18,6 +21,9 @@ from mangum import Mangum
 async def lifespan(app: FastAPI):
     create_db_and_tables()
     yield
+    writer = get_message_writer()
+    if writer is not None:
+        writer.close()
 
 
 app = FastAPI(
@@ -30,6 +36,8 @@ app = FastAPI(
 app.include_router(chats_router)
 app.include_router(users_router)
 app.include_router(auth_router)
+app.include_router(admin_router)
+app.include_router(search_router)
 
 app.add_middleware(
     CORSMiddleware,
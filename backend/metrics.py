@@ -0,0 +1,48 @@
+"""Fixed-bucket histograms for in-process metrics."""
+import bisect
+import threading
+from typing import Sequence
+
+
+class Histogram:
+    """
+    Counts observations into buckets with the given upper bounds.
+
+    An observation falls into the first bucket whose bound is at least its
+    value; larger values are counted in a final "+Inf" bucket.
+    """
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = sorted(bounds)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.bounds, value)] += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            count = sum(self._counts)
+            labels = [str(bound) for bound in self.bounds] + ["+Inf"]
+            return {
+                "count": count,
+                "sum": self._sum,
+                "avg": self._sum / count if count else 0.0,
+                "max": self._max,
+                "buckets": dict(zip(labels, self._counts)),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.bounds) + 1)
+            self._sum = 0.0
+            self._max = 0.0
@@ -0,0 +1,167 @@
+"""Versioned schema migrations.
+
+`SQLModel.metadata.create_all` only creates missing tables, so changes to
+existing tables (such as new indexes) are applied here. Each migration runs
+once per database, in order, and its version is recorded in the
+`schema_migrations` table. Migrations must be safe to run against a database
+whose tables were just created by `create_all` with the current models.
+"""
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+from sqlalchemy import (
+    Column, Connection, DateTime, Engine, Integer, MetaData, String, Table,
+    func, inspect, select,
+)
+from sqlalchemy.schema import CreateColumn
+from sqlmodel import SQLModel
+
+from backend import entities  # noqa: F401 (registers the tables on the metadata)
+from backend.counters import reconcile_chat_counters
+from backend.search import create_search_index, rebuild_search_index
+
+migrations_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migrations_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _create_indexes(*index_names: str) -> Callable[[Connection], None]:
+    """Build an upgrade step creating the named indexes declared on the models."""
+
+    def upgrade(connection: Connection):
+        indexes = {
+            index.name: index
+            for table in SQLModel.metadata.tables.values()
+            for index in table.indexes
+        }
+        for name in index_names:
+            indexes[name].create(connection, checkfirst=True)
+
+    return upgrade
+
+
+def _create_tables(*table_names: str) -> Callable[[Connection], None]:
+    """Build an upgrade step creating the named tables declared on the models."""
+
+    def upgrade(connection: Connection):
+        for name in table_names:
+            SQLModel.metadata.tables[name].create(connection, checkfirst=True)
+
+    return upgrade
+
+
+def _add_columns(table_name: str, *column_names: str) -> Callable[[Connection], None]:
+    """Build an upgrade step adding the named columns declared on a model."""
+
+    def upgrade(connection: Connection):
+        table = SQLModel.metadata.tables[table_name]
+        existing = {column["name"] for column in inspect(connection).get_columns(table_name)}
+        for name in column_names:
+            if name not in existing:
+                column = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD COLUMN {column}")
+
+    return upgrade
+
+
+def _add_chat_counters(connection: Connection):
+    # the repair bumps versions, so the version column of migration 7 comes first
+    _add_columns("chats", "message_count", "user_count", "last_message_at", "version")(connection)
+    reconcile_chat_counters(connection)
+
+
+def _add_search_index(connection: Connection):
+    create_search_index(connection)
+    rebuild_search_index(connection)
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(
+        version=1,
+        description="indexes for chat timelines and membership lookups",
+        upgrade=_create_indexes(
+            "ix_messages_chat_id_created_at_id",
+            "ix_messages_user_id",
+            "ix_chats_owner_id",
+            "ix_user_chat_links_chat_id_user_id",
+        ),
+    ),
+    Migration(
+        version=2,
+        description="refresh tokens and revoked access tokens",
+        upgrade=_create_tables("refresh_tokens", "revoked_tokens"),
+    ),
+    Migration(
+        version=3,
+        description="denormalized message and member counters on chats",
+        upgrade=_add_chat_counters,
+    ),
+    Migration(
+        version=4,
+        description="per-user read cursors of chats",
+        upgrade=_create_tables("chat_read_cursors"),
+    ),
+    Migration(
+        version=5,
+        description="index for listing chats by name",
+        upgrade=_create_indexes("ix_chats_name"),
+    ),
+    Migration(
+        version=6,
+        description="full-text search index of messages",
+        upgrade=_add_search_index,
+    ),
+    Migration(
+        version=7,
+        description="version of chats, for conditional requests",
+        upgrade=_add_columns("chats", "version"),
+    ),
+    Migration(
+        version=8,
+        description="index for pruning expired refresh tokens",
+        upgrade=_create_indexes("ix_refresh_tokens_expires_at"),
+    ),
+]
+
+
+def get_schema_version(connection: Connection) -> int:
+    """Return the version of the latest migration applied to the database."""
+    version = connection.execute(
+        select(func.max(schema_migrations.c.version))).scalar()
+    return version or 0
+
+
+def run_migrations(engine: Engine) -> list[int]:
+    """
+    Apply every pending migration, each in its own transaction.
+
+    :param engine: engine of the database to migrate
+    :return: the versions that were applied
+    """
+    migrations_metadata.create_all(engine)
+    applied = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        with engine.begin() as connection:
+            if migration.version <= get_schema_version(connection):
+                continue
+            migration.upgrade(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.now(),
+            ))
+        applied.append(migration.version)
+
+    return applied
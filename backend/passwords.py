@@ -0,0 +1,99 @@
+"""Password hashing on a dedicated, bounded executor.
+
+bcrypt costs hundreds of milliseconds of CPU per call. It runs on its own
+thread pool (bcrypt releases the GIL while hashing) so that a burst of logins
+cannot starve the threadpool serving every other endpoint, and at most
+PASSWORD_HASH_MAX_PENDING calls may be running or queued at once; past that,
+callers are turned away with a 503 instead of waiting in an unbounded queue.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+bcrypt_rounds = int(os.environ.get("BCRYPT_ROUNDS", default=12))
+hash_workers = int(os.environ.get("PASSWORD_HASH_WORKERS", default=os.cpu_count() or 1))
+hash_max_pending = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", default=4 * hash_workers))
+hash_retry_after = 1  # seconds
+
+# hashes made with fewer rounds than bcrypt_rounds are reported by
+# needs_update, and get replaced on the next successful login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=bcrypt_rounds,
+    bcrypt__min_rounds=bcrypt_rounds,
+)
+
+T = TypeVar("T")
+
+
+class PasswordHashingOverloaded(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail={
+                "error": "temporarily_unavailable",
+                "error_description": "too many password checks in progress",
+            },
+            headers={"Retry-After": str(hash_retry_after)},
+        )
+
+
+class PasswordHasher:
+    """Runs a CryptContext's hash and verify on a bounded executor."""
+
+    def __init__(
+            self,
+            context: CryptContext = pwd_context,
+            workers: int = hash_workers,
+            max_pending: int = hash_max_pending,
+    ):
+        self.context = context
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    async def _submit(self, fn: Callable[..., T], *args) -> T:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHashingOverloaded()
+            self._pending += 1
+        try:
+            return await asyncio.wrap_future(self._executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        """
+        Hash a password with the configured number of rounds.
+
+        :raises PasswordHashingOverloaded: if too many calls are pending
+        """
+        return await self._submit(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        """
+        Verify a password and rehash it if its hash is out of date.
+
+        :return: whether the password matches, and the replacement hash when
+            the stored one needs an update (see `CryptContext.needs_update`)
+        :raises PasswordHashingOverloaded: if too many calls are pending
+        """
+        return await self._submit(self.context.verify_and_update, password, hashed_password)
+
+
+password_hasher = PasswordHasher()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """FastAPI dependency to get the password hasher."""
+    return password_hasher
@@ -0,0 +1,144 @@
+"""Sampled, structured query logging and a table of the slowest queries.
+
+Listens to the engine's cursor events, so it sees every statement the ORM
+runs. It is off unless QUERY_LOG_SAMPLE_RATE or SLOW_QUERY_MS is set:
+- a QUERY_LOG_SAMPLE_RATE fraction of all statements is logged;
+- statements taking at least SLOW_QUERY_MS are always logged and are
+  aggregated by fingerprint into the slow-query table of GET /admin/slow-queries.
+Records are logged as JSON lines on the `backend.query` logger.
+
+A record's row_count is the cursor's rowcount: the rows changed by INSERT,
+UPDATE and DELETE on every driver, and the rows of a SELECT on drivers that
+buffer results when executing (psycopg2). It is None where the driver does
+not know, as for SELECTs on sqlite3 and aiosqlite, whose rows are not
+fetched yet when the statement is logged.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import Engine, event
+
+logger = logging.getLogger("backend.query")
+
+query_log_sample_rate = float(os.environ.get("QUERY_LOG_SAMPLE_RATE", default=0))
+_slow_query_ms = os.environ.get("SLOW_QUERY_MS")
+slow_query_ms = float(_slow_query_ms) if _slow_query_ms else None
+slow_query_table_size = int(os.environ.get("SLOW_QUERY_TABLE_SIZE", default=50))
+
+_whitespace = re.compile(r"\s+")
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"\b\d+(?:\.\d+)?\b")
+_placeholder_list = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)\s*,?)+\)")
+
+
+def normalize_statement(statement: str) -> str:
+    """Reduce a statement to its shape: literals and IN lists become `?`."""
+    statement = _whitespace.sub(" ", statement).strip()
+    statement = _string_literal.sub("?", statement)
+    statement = _number_literal.sub("?", statement)
+    return _placeholder_list.sub("(?)", statement)
+
+
+def fingerprint(normalized_statement: str) -> str:
+    return hashlib.sha1(normalized_statement.encode()).hexdigest()[:12]
+
+
+class QueryLog:
+    """Times statements, logs a sample of them and tracks the slowest shapes."""
+
+    def __init__(
+            self,
+            sample_rate: float = query_log_sample_rate,
+            slow_ms: Optional[float] = slow_query_ms,
+            table_size: int = slow_query_table_size,
+    ):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.table_size = table_size
+        self._lock = threading.Lock()
+        self._slow_queries: dict[str, dict] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ms is not None
+
+    def install(self, engine: Engine):
+        """Start timing the statements run on engine (a sync engine)."""
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_log_start", []).append(time.perf_counter())
+
+    def _handle_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_log_start"):
+            connection.info["query_log_start"].pop()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration_ms = 1000 * (time.perf_counter() - conn.info["query_log_start"].pop())
+        is_slow = self.slow_ms is not None and duration_ms >= self.slow_ms
+        if not is_slow and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return
+
+        row_count = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        self.record(statement, duration_ms, row_count, is_slow)
+
+    def record(self, statement: str, duration_ms: float, row_count: Optional[int], is_slow: bool):
+        normalized = normalize_statement(statement)
+        record = {
+            "fingerprint": fingerprint(normalized),
+            "statement": normalized,
+            "duration_ms": round(duration_ms, 3),
+            "row_count": row_count,
+            "slow": is_slow,
+        }
+        logger.info(json.dumps(record))
+
+        if is_slow:
+            self._record_slow(record)
+
+    def _record_slow(self, record: dict):
+        with self._lock:
+            entry = self._slow_queries.get(record["fingerprint"])
+            if entry is None:
+                if len(self._slow_queries) >= self.table_size:
+                    # evict the entry with the fastest worst case
+                    fastest = min(self._slow_queries.values(), key=lambda e: e["max_ms"])
+                    if fastest["max_ms"] >= record["duration_ms"]:
+                        return
+                    del self._slow_queries[fastest["fingerprint"]]
+                entry = self._slow_queries[record["fingerprint"]] = {
+                    "fingerprint": record["fingerprint"],
+                    "statement": record["statement"],
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += record["duration_ms"]
+            entry["max_ms"] = max(entry["max_ms"], record["duration_ms"])
+            entry["last_row_count"] = record["row_count"]
+
+    def slow_queries(self) -> list[dict]:
+        """The tracked statement shapes, slowest first."""
+        with self._lock:
+            entries = [dict(entry) for entry in self._slow_queries.values()]
+        for entry in entries:
+            entry["avg_ms"] = entry["total_ms"] / entry["count"]
+        return sorted(entries, key=lambda e: e["max_ms"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._slow_queries.clear()
+
+
+query_log = QueryLog()
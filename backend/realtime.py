@@ -0,0 +1,140 @@
+"""Fan-out of newly created chat messages to live subscribers."""
+import asyncio
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, AsyncIterator, Optional
+
+subscriber_queue_size = int(os.environ.get("HUB_QUEUE_SIZE", default=100))
+sse_heartbeat_interval = float(os.environ.get("SSE_HEARTBEAT_SECONDS", default=15))
+sse_retry_interval = 3000  # milliseconds
+
+
+def chat_topic(chat_id: int) -> str:
+    return f"chats/{chat_id}"
+
+
+def format_event(data: str, event_id: Optional[int] = None, event: Optional[str] = None) -> str:
+    """Format a single server-sent event; data must not contain newlines."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
+
+
+def format_heartbeat() -> str:
+    """An SSE comment line, ignored by clients but keeping proxies from timing out."""
+    return ": heartbeat\n\n"
+
+
+class Broker(ABC):
+    """
+    Interface for publishing messages to subscribers of a topic.
+
+    The in-process `Hub` only reaches subscribers of the current worker. A
+    broker backed by an external pub/sub service can implement the same
+    interface so that several workers share subscribers.
+    """
+
+    @abstractmethod
+    async def publish(self, topic: str, message: dict) -> None:
+        """Deliver message to every current subscriber of topic."""
+
+    @abstractmethod
+    def subscribe(self, topic: str) -> AsyncContextManager["Subscription"]:
+        """Subscribe to topic for the duration of the `async with` block."""
+
+
+class Subscription:
+    """
+    A subscriber's bounded queue of pending messages.
+
+    A subscriber that falls `maxsize` messages behind is dropped rather than
+    slowing down publishers or buffering without bound; iteration then stops
+    and `dropped` is set so the consumer can tell its client to resync.
+    """
+
+    def __init__(self, maxsize: int):
+        self.loop = asyncio.get_running_loop()
+        self.dropped = False
+        self._queue: asyncio.Queue[Optional[dict]] = asyncio.Queue(maxsize)
+
+    def offer(self, message: dict):
+        """Enqueue message; must run on the subscriber's event loop."""
+        if self.dropped:
+            return
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        message = await self._queue.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+
+class Hub(Broker):
+    """In-process broker; safe to publish to from any thread or event loop."""
+
+    def __init__(self, queue_size: int = subscriber_queue_size):
+        self.queue_size = queue_size
+        self.dropped_subscribers = 0
+        self._lock = threading.Lock()
+        self._subscriptions: dict[str, set[Subscription]] = {}
+
+    async def publish(self, topic: str, message: dict) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, ()))
+
+        current_loop = asyncio.get_running_loop()
+        for subscription in subscriptions:
+            if subscription.loop is current_loop:
+                self._offer(subscription, message)
+            elif not subscription.loop.is_closed():
+                subscription.loop.call_soon_threadsafe(
+                    self._offer, subscription, message)
+
+    def _offer(self, subscription: Subscription, message: dict):
+        was_dropped = subscription.dropped
+        subscription.offer(message)
+        if subscription.dropped and not was_dropped:
+            with self._lock:
+                self.dropped_subscribers += 1
+
+    @asynccontextmanager
+    async def subscribe(self, topic: str) -> AsyncIterator[Subscription]:
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(topic, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscriptions = self._subscriptions.get(topic, set())
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    self._subscriptions.pop(topic, None)
+
+    def subscriber_count(self, topic: str) -> int:
+        with self._lock:
+            return len(self._subscriptions.get(topic, ()))
+
+
+broker: Broker = Hub()
+
+
+def get_broker() -> Broker:
+    """FastAPI dependency to get the message broker."""
+    return broker
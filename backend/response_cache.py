@@ -0,0 +1,193 @@
+"""Server-side cache of read-mostly responses, invalidated by write events.
+
+`GET /users`, `GET /users/{user_id}`, `GET /chats` and
+`GET /chats/{chat_id}/users` keep their responses in `response_cache`, keyed
+by route and parameters. Each entry is tagged with what it shows, such as
+`user:7` for every response listing user 7 or `chat_users:3` for the
+members of chat 3.
+
+Writes emit invalidation events for exactly those tags. A session listener
+derives them from the users, chats and memberships each flush changes, and
+code writing without the ORM (bulk registration) emits its own with
+`invalidate_on_commit`. No cached response shows messages, so new messages
+emit nothing. The events are applied once the transaction commits,
+so that no reader can re-cache the old rows in between, and are dropped if
+it rolls back.
+
+The store is an in-process LRU by default. Setting RESPONSE_CACHE_BACKEND to
+`package.module:factory` plugs in any `CacheBackend` (eg one on an external
+store shared by the workers). With the in-process store, a write is only
+seen at once by the worker that made it; other workers serve their cached
+copy for up to RESPONSE_CACHE_TTL seconds. `GET /chats/{chat_id}/users` is
+the exception: it is keyed by the chat's ETag, which is read from the
+database, so it never serves an old list under a new ETag.
+"""
+import importlib
+import os
+import threading
+from typing import Awaitable, Callable, Hashable, Iterable, TypeVar
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from backend.cache import CacheBackend, TTLCache, caches
+from backend.entities import ChatInDB, UserChatLinkInDB, UserInDB
+
+response_cache_size = int(os.environ.get("RESPONSE_CACHE_SIZE", default=1024))
+response_cache_ttl = float(os.environ.get("RESPONSE_CACHE_TTL", default=30))
+response_cache_backend = os.environ.get("RESPONSE_CACHE_BACKEND", default="memory")
+
+# tags of the collections that grow when a user or chat is created
+USERS_TAG = "users"
+CHATS_TAG = "chats"
+
+
+def user_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def chat_tag(chat_id: int) -> str:
+    return f"chat:{chat_id}"
+
+
+def chat_users_tag(chat_id: int) -> str:
+    return f"chat_users:{chat_id}"
+
+
+T = TypeVar("T")
+
+
+class ResponseCache:
+    """Caches route responses in a CacheBackend and counts hits and misses per route."""
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._routes: dict[str, list[int]] = {}  # route -> [hits, misses]
+
+    async def get_or_load(
+            self,
+            route: str,
+            key: tuple[Hashable, ...],
+            load: Callable[[], Awaitable[tuple[T, Iterable[str]]]],
+    ) -> T:
+        """
+        Return the cached response, or load and cache it.
+
+        :param route: name of the route, for the per-route statistics
+        :param key: the parameters the response depends on
+        :param load: loads the response and its tags on a miss
+        :return: the response
+        """
+        value = self.backend.get((route, *key))
+        self._count(route, hit=value is not None)
+        if value is not None:
+            return value
+
+        # read first: a write committed while loading makes the set a no-op
+        generation = self.backend.generation
+        value, tags = await load()
+        self.backend.set((route, *key), value, generation=generation, tags=tags)
+        return value
+
+    def _count(self, route: str, hit: bool):
+        with self._lock:
+            counts = self._routes.setdefault(route, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def invalidate(self, tags: Iterable[str]):
+        tags = set(tags)
+        if tags:
+            self.backend.invalidate_tags(tags)
+
+    def clear(self):
+        """Drop every entry and reset the per-route statistics."""
+        self.backend.clear()
+        with self._lock:
+            self._routes.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {
+                route: {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+                }
+                for route, (hits, misses) in self._routes.items()
+            }
+        return {**self.backend.stats(), "routes": routes}
+
+
+def create_backend(spec: str = response_cache_backend) -> CacheBackend:
+    """
+    Create the store of the response cache.
+
+    :param spec: "memory" for the in-process LRU, or "package.module:factory"
+        for a callable returning a CacheBackend
+    """
+    if spec == "memory":
+        return TTLCache(max_size=response_cache_size, ttl=response_cache_ttl)
+    module_name, _, factory_name = spec.partition(":")
+    factory = getattr(importlib.import_module(module_name), factory_name)
+    return factory()
+
+
+response_cache = ResponseCache(create_backend())
+caches["responses"] = response_cache
+
+
+def invalidate_on_commit(session: Session, *tags: str):
+    """Invalidate tags once the session's transaction commits, for writes that bypass the ORM."""
+    session.info.setdefault("invalidated_tags", set()).update(tags)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_invalidations(session: Session, flush_context):
+    tags = set()
+    for obj in session.new:
+        if isinstance(obj, UserInDB):
+            tags.add(USERS_TAG)
+        elif isinstance(obj, ChatInDB):
+            tags.add(CHATS_TAG)
+    for obj in session.deleted:
+        if isinstance(obj, UserInDB):
+            tags.update([USERS_TAG, user_tag(obj.id)])
+        elif isinstance(obj, ChatInDB):
+            tags.update([CHATS_TAG, chat_tag(obj.id), chat_users_tag(obj.id)])
+    for obj in session.dirty:
+        if isinstance(obj, UserInDB) and _columns_changed(obj):
+            tags.add(user_tag(obj.id))
+        elif isinstance(obj, ChatInDB) and _columns_changed(obj):
+            tags.add(chat_tag(obj.id))
+
+    for obj in session.new | session.deleted:
+        if isinstance(obj, UserChatLinkInDB):
+            tags.add(chat_users_tag(obj.chat_id))
+    for obj in session.new | session.dirty:
+        # memberships changed through either side of the relationship
+        if isinstance(obj, ChatInDB) and inspect(obj).attrs.users.history.has_changes():
+            tags.add(chat_users_tag(obj.id))
+        elif isinstance(obj, UserInDB):
+            history = inspect(obj).attrs.chats.history
+            for chat in [*(history.added or ()), *(history.deleted or ())]:
+                tags.add(chat_users_tag(chat.id))
+
+    invalidate_on_commit(session, *tags)
+
+
+def _columns_changed(obj) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[column.key].history.has_changes() for column in state.mapper.column_attrs)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session: Session):
+    tags = session.info.pop("invalidated_tags", None)
+    if tags:
+        response_cache.invalidate(tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session: Session):
+    session.info.pop("invalidated_tags", None)
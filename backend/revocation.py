@@ -0,0 +1,84 @@
+"""Denylist of revoked access tokens.
+
+Access tokens are stateless, so revoking one records its `jti` claim in the
+`revoked_tokens` table until the token expires. Each worker keeps the
+unexpired entries in memory, so checking a token is a set lookup; the set is
+reloaded from the database at most every REVOCATION_SYNC_SECONDS, which is
+how long a revocation made by another worker can take to be seen. A
+revocation made by this worker applies immediately.
+"""
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlmodel import Session, delete, select
+
+from backend.entities import RevokedTokenInDB
+
+revocation_sync_interval = float(os.environ.get("REVOCATION_SYNC_SECONDS", default=5))
+
+
+class RevocationList:
+    """In-memory set of revoked token ids, synced from the database."""
+
+    def __init__(
+            self,
+            sync_interval: float = revocation_sync_interval,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.sync_interval = sync_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._revoked: dict[str, int] = {}  # jti -> exp
+        self._next_sync: Optional[float] = None
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        return jti is not None and jti in self._revoked
+
+    def sync_if_due(self, session: Session):
+        """Reload the revoked tokens if the last sync is older than the interval."""
+        if self._next_sync is not None and self.clock() < self._next_sync:
+            return
+        self.sync(session)
+
+    def sync(self, session: Session):
+        """Replace the in-memory set with the unexpired revocations in the database."""
+        now = int(time.time())
+        rows = session.exec(
+            select(RevokedTokenInDB.jti, RevokedTokenInDB.expires_at)
+            .where(RevokedTokenInDB.expires_at > now)
+        ).all()
+        with self._lock:
+            self._revoked = {jti: expires_at for jti, expires_at in rows}
+            self._next_sync = self.clock() + self.sync_interval
+
+    def revoke(self, session: Session, jti: str, expires_at: int):
+        """
+        Revoke the token with the given id until it expires.
+
+        Expired revocations are pruned from the database at the same time.
+        """
+        now = int(time.time())
+        session.exec(delete(RevokedTokenInDB).where(RevokedTokenInDB.expires_at <= now))
+        if session.get(RevokedTokenInDB, jti) is None:
+            session.add(RevokedTokenInDB(jti=jti, expires_at=expires_at))
+        session.commit()
+        with self._lock:
+            self._revoked[jti] = expires_at
+            self._revoked = {
+                jti: expires_at for jti, expires_at in self._revoked.items()
+                if expires_at > now
+            }
+
+    def reset(self):
+        """Forget every revocation and sync on the next check."""
+        with self._lock:
+            self._revoked = {}
+            self._next_sync = None
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+
+revocations = RevocationList()
@@ -0,0 +1,72 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+
+from backend.auth import get_admin_user
+from backend import database as db
+from backend.cache import caches
+from backend.group_commit import MessageWriter, get_message_writer
+from backend.query_log import query_log
+
+# operator routes, for admins only (see ADMIN_USER_IDS): each requires the bearer token of an admin
+admin_router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(get_admin_user)])
+
+
+# GET /admin/pool returns the occupancy of the database connection pools and their checkout statistics: how many
+# checkouts succeeded or timed out and how long requests waited for a connection.
+@admin_router.get("/pool", status_code=200)
+async def get_pool_stats() -> dict:
+    """
+
+    :return: statistics of each connection pool
+    returns connection pool statistics
+
+    """
+    return db.get_pool_stats()
+
+
+# GET /admin/slow-queries returns the statement shapes that took at least SLOW_QUERY_MS, slowest first, with their
+# count, total, average and maximum duration. It is empty unless SLOW_QUERY_MS is set.
+@admin_router.get("/slow-queries", status_code=200)
+async def get_slow_queries() -> dict:
+    """
+
+    :return: the slowest queries
+    returns the slow-query table
+
+    """
+    slow_queries = query_log.slow_queries()
+    return {
+        "meta": {"count": len(slow_queries), "threshold_ms": query_log.slow_ms},
+        "queries": slow_queries,
+    }
+
+
+# GET /admin/caches returns the size, hit and miss counts and hit ratio of each in-process cache.
+@admin_router.get("/caches", status_code=200)
+async def get_cache_stats() -> dict:
+    """
+
+    :return: statistics of each cache
+    returns cache statistics
+
+    """
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+# GET /admin/group-commit returns the settings of the group commit of new messages and histograms of the number of
+# messages per flush, the duration of each flush and how long requests waited for their message to be committed.
+@admin_router.get("/group-commit", status_code=200)
+async def get_group_commit_stats(
+        writer: Optional[MessageWriter] = Depends(get_message_writer)) -> dict:
+    """
+
+    :param writer:
+    :return: group commit statistics
+    returns group commit statistics, or only that it is disabled
+
+    """
+    if writer is None:
+        return {"enabled": False}
+    return {"enabled": True, **writer.stats()}
+
@@ -1,37 +1,85 @@
-from typing import List
-from fastapi import APIRouter, HTTPException, Depends, Query
+import asyncio
+import json
+from typing import Annotated, AsyncIterator, List, Optional
+from fastapi import (
+    APIRouter, BackgroundTasks, Body, HTTPException, Depends, Header, Query, Request,
+    Response, WebSocket, WebSocketDisconnect, status,
+)
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session
 
-from backend.auth import get_current_user
+from backend.auth import AuthException, get_current_user, get_connection_user
 from backend import database as db
 from backend.entities import *
+from backend.etags import (
+    chat_cache_control, conditional_chat, messages_cache_control, users_cache_control,
+)
+from backend.export import accepts_gzip, export_media_type, export_stream, gzip_stream
+from backend.group_commit import MessageWriter, get_message_writer
+from backend.json_responses import json_response, render
+from backend.response_cache import CHATS_TAG, chat_tag, chat_users_tag, response_cache, user_tag
+from backend.search import search_response
+from backend.realtime import (
+    Broker, chat_topic, format_event, format_heartbeat, get_broker,
+    sse_heartbeat_interval, sse_retry_interval,
+)
+
+sse_backlog_page_size = 500
+message_batch_max_size = 1000
 
 chats_router = APIRouter(prefix="/chats", tags=["Chats"])
 
 
-# GET /chats returns a list of chats sorted by name alongside some metadata.
-# The metadata has the count of chats (integer). The response has the HTTP status code 200
-@chats_router.get("", response_model=ChatCollection)
-def get_chats(session: Session = Depends(db.get_session)):
+# GET /chats returns a page of chats sorted by name alongside some metadata. `sort` (name or id) and `order` (asc or
+# desc) choose another order, `offset` and `limit` (at most 1000) select the page, `name_prefix` only keeps chats whose
+# name starts with it, and `fields` (repeatable) only returns the given fields of each chat. The metadata has the count
+# of chats in the page (integer) and the offset of the next page, if any. The response has the HTTP status code 200
+@chats_router.get("", response_model=ChatCollection, response_model_exclude_unset=True)
+async def get_chats(
+        sort: str = "name",
+        order: str = "asc",
+        offset: int = Query(0, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        name_prefix: Optional[str] = None,
+        fields: List[str] = Query(None),
+        session: Session = Depends(db.get_session)):
     """
 
-    :return: a list of chats
-    gets all chats sorted by name
+    :param sort: the field to sort by
+    :param order: asc or desc
+    :param offset: number of chats to skip
+    :param limit: maximum number of chats in the page
+    :param name_prefix: only return chats whose name starts with it
+    :param fields: only return these fields of each chat
+    :return: a page of chats
+    gets a page of chats sorted by name
 
     """
-    chats = db.get_all_chats(session)
-    return ChatCollection(
-        meta={"count": len(chats)},
-        chats=chats,
-    )
-
-
+    async def load():
+        chats, next_offset = await db.run(
+            session, db.get_all_chats, sort=sort, order=order, offset=offset, limit=limit,
+            name_prefix=name_prefix, fields=fields)
+        tags = [CHATS_TAG, *(chat_tag(chat.id) for chat in chats)]
+        if fields is None or "owner" in fields:
+            tags += [user_tag(chat.owner.id) for chat in chats]
+        if fields is not None:
+            chats = [ChatFields(**{field: getattr(chat, field) for field in fields}) for chat in chats]
+        return ChatCollection(meta={"count": len(chats), "next_offset": next_offset}, chats=chats), tags
+
+    key = (sort, order, offset, limit, name_prefix, fields and tuple(fields))
+    return await response_cache.get_or_load("get_chats", key, load)
+
+
+# GET /chats/{chat_id} returns a chat and its metadata, and its messages and users when listed in `include`. Like its
+# messages and users below, it is conditional: the response has a weak ETag, and a request whose If-None-Match matches
+# it gets an empty 304 Not Modified.
 @chats_router.get(
     "/{chat_id}",
     status_code=200,
     response_model=ChatByIDResponse,
-    response_model_exclude_none=True)
-def get_chat_by_id(
+    response_model_exclude_none=True,
+    dependencies=[Depends(conditional_chat(chat_cache_control))])
+async def get_chat_by_id(
         chat_id: int,
         include: List[str] = Query(None),
         session: Session = Depends(db.get_session)):
@@ -43,24 +91,24 @@ def get_chat_by_id(
     gets a chat by id
 
     """
-    chat = db.get_chat_by_id(chat_id, session)
+    include = include or []
+    chat = await db.run(
+        session, db.get_chat_by_id, chat_id,
+        with_users="users" in include, with_messages="messages" in include)
+    # maintained counters, so the metadata costs nothing however big the chat
     chat_meta_data = ChatMetaData(
-        message_count=len(chat.messages),
-        user_count=len(chat.users)
+        message_count=chat.message_count,
+        user_count=chat.user_count
     )
     ret = ChatByIDResponse(
         meta=chat_meta_data,
         chat=chat,
     )
 
-    if include and "messages" in include:
-        t = []
-        for m in chat.messages:
-            t.append(Message(id=m.id, chat_id=m.chat_id, text=m.text,
-                     user=m.user, created_at=m.created_at))
-        ret.messages = sorted(
-            t, key=lambda message: getattr(message, "created_at"))
-    if include and "users" in include:
+    if "messages" in include:
+        # loaded in (created_at, id) order by the relationship
+        ret.messages = chat.messages
+    if "users" in include:
         ret.users = chat.users
 
     return ret
@@ -69,7 +117,7 @@ def get_chat_by_id(
 
 
 @chats_router.put("/{chat_id}", status_code=200, response_model=ChatResponse)
-def update_chat(chat_id: int, chat_update: ChatUpdate, session: Session = Depends(db.get_session)):
+async def update_chat(chat_id: int, chat_update: ChatUpdate, session: Session = Depends(db.get_session)):
     """
 
     :param session:
@@ -80,56 +128,155 @@ def update_chat(chat_id: int, chat_update: ChatUpdate, session: Session = Depend
 
     """
     return ChatResponse(
-        chat=db.update_chat(chat_id, chat_update, session),
+        chat=await db.run(session, db.update_chat, chat_id, chat_update),
     )
 
 
-# GET /chats/{chat_id}/messages returns a list of messages for a given chat id
-# alongside some metadata. sort by created at
+# GET /chats/{chat_id}/messages returns a page of messages for a given chat id
+# alongside some metadata. sorted by created at, oldest first unless order=desc.
+# pages are selected with the opaque `before`/`after` cursors, and
+# meta.next_cursor points at the next page. conditional, see GET /chats/{chat_id}.
+# the page is rendered on the fast JSON path, see backend/json_responses.py.
 @chats_router.get(
     "/{chat_id}/messages",
     status_code=200,
-    response_model=MessageCollection)
-def get_messages_for_chat_id(chat_id: int, session: Session = Depends(db.get_session)):
+    response_model=MessagePage,
+    dependencies=[Depends(conditional_chat(messages_cache_control))])
+async def get_messages_for_chat_id(
+        chat_id: int,
+        response: Response,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=1000),
+        sort: str = "created_at",
+        order: str = "asc",
+        session: Session = Depends(db.get_session)):
     """
 
     :param session:
+    :param response: carries the ETag and Cache-Control headers
     :param chat_id: the chat id
-    :return: a list of messages for a chat
-    returns a list of messages for a given chat id
+    :param before: cursor; only return messages older than it
+    :param after: cursor; only return messages newer than it
+    :param limit: maximum number of messages in the page
+    :param sort: the field to sort by; only created_at
+    :param order: asc or desc
+    :return: a page of messages for a chat
+    returns a page of messages for a given chat id
 
     """
-    messages = db.get_messages_in_chat(chat_id, session)
+    messages, next_cursor = await db.run(
+        session, db.get_message_rows, chat_id,
+        before=before, after=after, limit=limit, sort=sort, order=order)
 
-    return MessageCollection(
-        meta={"count": len(messages)},
-        messages=sorted(messages, key=lambda message: getattr(
-            message, "created_at"))
-    )
+    meta = CursorMetadata(count=len(messages), next_cursor=next_cursor)
+    return json_response(render({"meta": meta.model_dump(), "messages": messages}), headers=response.headers)
+
+
+# GET /chats/{chat_id}/messages/search?q= returns the messages of a chat containing every word of q, most relevant
+# first, alongside some metadata. Each message has its relevance score (higher is better) and a highlight: an
+# HTML-escaped excerpt of its text with the matching words wrapped in <mark> tags. `offset` and `limit` select the page;
+# the metadata has the count of messages in the page and the offset of the next page, if any.
+@chats_router.get(
+    "/{chat_id}/messages/search",
+    status_code=200,
+    response_model=MessageSearchResponse)
+async def search_chat_messages(
+        chat_id: int,
+        q: str = Query(min_length=1, max_length=200),
+        offset: int = Query(0, ge=0),
+        limit: int = Query(20, ge=1, le=100),
+        session: Session = Depends(db.get_session)):
+    """
+
+    :param session:
+    :param chat_id: the chat id
+    :param q: the words to search for
+    :param offset: number of results to skip
+    :param limit: maximum number of results in the page
+    :return: a page of matching messages
+    searches the messages of a chat
+
+    """
+    results, next_offset = await db.run(
+        session, db.search_messages, query=q, chat_id=chat_id, offset=offset, limit=limit)
+    return search_response(results, next_offset)
+
+
+# GET /chats/{chat_id}/messages/export streams every message of a chat, oldest first, for compliance exports of chats
+# of any size: as newline-delimited JSON with one message object (like those of GET /chats/{chat_id}/messages) per
+# line, or as CSV with `format=csv`. The stream is gzipped for clients that accept it. It requires the bearer token of
+# a member of the chat; for anyone else the chat is not found. See backend/export.py.
+@chats_router.get(
+    "/{chat_id}/messages/export",
+    status_code=200,
+    response_class=StreamingResponse)
+async def export_chat_messages(
+        chat_id: int,
+        format: str = "ndjson",
+        accept_encoding: Optional[str] = Header(None),
+        session: Session = Depends(db.get_session),
+        user: UserInDB = Depends(get_current_user)):
+    """
+
+    :param chat_id: the chat id
+    :param format: ndjson or csv
+    :param accept_encoding: gzip is used if it is accepted
+    :param session:
+    :param user: a member of the chat
+    :return: a stream of every message of the chat
+    exports the messages of a chat
+
+    """
+    media_type = export_media_type(format)
+    stmt = await db.run(session, db.message_export_statement, chat_id, user.id)
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="chat-{chat_id}-messages.{format}"',
+        "Vary": "Accept-Encoding",
+    }
+    content = export_stream(session, stmt, format)
+    if accepts_gzip(accept_encoding):
+        headers["Content-Encoding"] = "gzip"
+        content = gzip_stream(content)
+    return StreamingResponse(content, media_type=media_type, headers=headers)
 
 
 # GET /chats/{chat_id}/users returns a list of users for a given chat id alongside some metadata. The list of users
-# consists of only those users participating in the corresponding chat, sorted by id. The metadata contains the count
-# of users (integer). If a chat with the id exists, the response has the HTTP status code 200 and adheres to the format:
+# consists of only those users participating in the corresponding chat, sorted by id, or as chosen by `sort` (id or
+# username) and `order` (asc or desc). The metadata contains the count of users (integer). If a chat with the id
+# exists, the response has the HTTP status code 200 and adheres to the format below. Conditional, see GET
+# /chats/{chat_id}.
 @chats_router.get(
     "/{chat_id}/users",
     status_code=200,
-    response_model=UsersInChatResponse
+    response_model=UsersInChatResponse,
 )
-def get_users_for_chat(chat_id: int, session: Session = Depends(db.get_session)) -> UsersInChatResponse:
+async def get_users_for_chat(
+        chat_id: int,
+        sort: str = "id",
+        order: str = "asc",
+        etag: str = Depends(conditional_chat(users_cache_control)),
+        session: Session = Depends(db.get_session)) -> UsersInChatResponse:
     """
 
     :param session:
     :param chat_id: id of the chat
+    :param sort: the field to sort by
+    :param order: asc or desc
+    :param etag: the ETag of the response, from the chat's current version
     :return: a list of users in a chat
     returns a list of users for a given chat
 
     """
-    users = db.get_users_in_chat(chat_id, session)
-    return UsersInChatResponse(
-        meta={"count": len(users)},
-        users=users,
-    )
+    async def load():
+        users = await db.run(session, db.get_users_in_chat, chat_id, sort=sort, order=order)
+        tags = [chat_users_tag(chat_id), *(user_tag(user.id) for user in users)]
+        return UsersInChatResponse(meta={"count": len(users)}, users=users), tags
+
+    # keyed by the version too: a worker that did not see a membership change
+    # must not serve its cached list under the new ETag
+    return await response_cache.get_or_load("get_users_for_chat", (chat_id, etag, sort, order), load)
 
 
 # POST /chats/{chat_id}/messages creates a new message in the chat, authored by the current user. It requires a valid
@@ -138,9 +285,12 @@ def get_users_for_chat(chat_id: int, session: Session = Depends(db.get_session))
     "/{chat_id}/messages",
     status_code=201,
     response_model=MessageResponse)
-def create_message(
+async def create_message(
+        background_tasks: BackgroundTasks,
         session: Session = Depends(db.get_session),
         user: UserInDB = Depends(get_current_user),
+        broker: Broker = Depends(get_broker),
+        writer: Optional[MessageWriter] = Depends(get_message_writer),
         new_message_text: MessageCreate = None,
         chat_id: int = None):
     """
@@ -148,24 +298,229 @@ def create_message(
     :param new_message_text:
     :param session:
     :param user:
+    :param broker: publishes the new message to live subscribers of the chat
+    :param writer: commits the message together with others, if group commit is on
     :param chat_id:
     :return:
     """
-    # checks that chat exists (throws exception if not)
-    db.get_chat_by_id(chat_id, session=session)
+    if writer is None:
+        message = await db.run(
+            session, db.create_message,
+            chat_id=chat_id, text=new_message_text.text, user=user)
+    else:
+        # checks that chat exists (throws exception if not)
+        await db.run(session, db.get_chat_by_id, chat_id)
+        message = await writer.write(
+            chat_id=chat_id, text=new_message_text.text, user=user)
+
+    response = MessageResponse(
+        message=message
+    )
+    background_tasks.add_task(
+        broker.publish, chat_topic(chat_id), response.model_dump(mode="json"))
 
-    test = {
-        "text": new_message_text.text,
-        "user_id": user.id,
-        "chat_id": chat_id
-    }
+    return response
+
+
+# POST /chats/{chat_id}/messages:batch creates many messages in the chat at once, authored by the current user, for
+# bots and imports. The request body is an array of up to 1000 MessageCreate objects. The messages are inserted in one
+# transaction, so either all of them are created or none. It requires a valid bearer token.
+@chats_router.post(
+    "/{chat_id}/messages:batch",
+    status_code=201,
+    response_model=MessageCollection)
+async def create_messages(
+        chat_id: int,
+        new_messages: Annotated[
+            List[MessageCreate], Body(min_length=1, max_length=message_batch_max_size)],
+        background_tasks: BackgroundTasks,
+        session: Session = Depends(db.get_session),
+        user: UserInDB = Depends(get_current_user),
+        broker: Broker = Depends(get_broker)):
+    """
+
+    :param chat_id: the chat id
+    :param new_messages: the messages to create, in order
+    :param session:
+    :param user: the author of the messages
+    :param broker: publishes the new messages to live subscribers of the chat
+    :return: the created messages, in order
+    """
+    messages = await db.run(
+        session, db.create_messages,
+        chat_id=chat_id, texts=[message.text for message in new_messages], user=user)
+
+    collection = MessageCollection(
+        meta={"count": len(messages)},
+        messages=messages,
+    )
+    for message in collection.messages:
+        background_tasks.add_task(
+            broker.publish, chat_topic(chat_id),
+            MessageResponse(message=message).model_dump(mode="json"))
 
-    message = MessageInDB(**test)
+    return collection
 
-    session.add(message)
-    session.commit()
-    session.refresh(message)
 
-    return MessageResponse(
-        message=message
+# PUT /chats/{chat_id}/read records that the current user has read the chat up to the given message, which clears the
+# unread count in GET /users/{user_id}/chats. The read position never moves backwards. It requires the bearer token of
+# a member of the chat; for anyone else the chat is not found.
+@chats_router.put("/{chat_id}/read", status_code=204)
+async def mark_chat_read(
+        chat_id: int,
+        read: ReadCursorUpdate,
+        session: Session = Depends(db.get_session),
+        user: UserInDB = Depends(get_current_user)):
+    """
+
+    :param chat_id: the chat id
+    :param read: the last message read
+    :param session:
+    :param user: the reader
+    marks a chat read up to a message
+
+    """
+    await db.run(
+        session, db.update_read_cursor,
+        chat_id=chat_id, user_id=user.id, message_id=read.message_id)
+
+
+# WS /chats/{chat_id}/ws streams messages created in the chat after the connection is opened. Each message is sent as
+# a MessageResponse JSON object. It requires a valid bearer token, passed as the `token` query parameter or in the
+# Authorization header. A client that falls too far behind is disconnected with code 1013 and should resync through
+# GET /chats/{chat_id}/messages.
+@chats_router.websocket("/{chat_id}/ws")
+async def chat_websocket(
+        websocket: WebSocket,
+        chat_id: int,
+        session: Session = Depends(db.get_session),
+        broker: Broker = Depends(get_broker)):
+    """
+
+    :param websocket:
+    :param chat_id: the chat id
+    :param session:
+    :param broker: source of the new messages
+    streams new messages in a chat
+
+    """
+    try:
+        await db.run(session, get_connection_user, connection=websocket)
+        await db.run(session, db.get_chat_by_id, chat_id)
+    except (AuthException, db.EntityNotFoundException):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        # don't hold a database connection for the lifetime of the socket
+        await db.close(session)
+
+    await websocket.accept()
+    async with broker.subscribe(chat_topic(chat_id)) as subscription:
+        forward = asyncio.create_task(_forward(websocket, subscription))
+        receive = asyncio.create_task(_wait_for_disconnect(websocket))
+        await asyncio.wait([forward, receive], return_when=asyncio.FIRST_COMPLETED)
+        forward.cancel()
+        receive.cancel()
+
+        if subscription.dropped:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+
+async def _forward(websocket: WebSocket, subscription):
+    async for message in subscription:
+        await websocket.send_json(message)
+
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+
+# GET /chats/{chat_id}/events streams messages created in the chat as server-sent events, for clients that cannot use
+# the websocket. Each event has the message id as its id and a MessageResponse JSON object as its data. A reconnecting
+# client that sends Last-Event-ID first receives the messages it missed. It requires a valid bearer token, passed in
+# the Authorization header or as the `token` query parameter.
+@chats_router.get(
+    "/{chat_id}/events",
+    status_code=200,
+    response_class=StreamingResponse)
+async def get_chat_events(
+        request: Request,
+        chat_id: int,
+        last_event_id: Optional[int] = Header(None),
+        session: Session = Depends(db.get_session),
+        broker: Broker = Depends(get_broker)):
+    """
+
+    :param request:
+    :param chat_id: the chat id
+    :param last_event_id: id of the last message the client received
+    :param session:
+    :param broker: source of the new messages
+    :return: an event stream of new messages
+    streams new messages in a chat
+
+    """
+    await db.run(session, get_connection_user, connection=request)
+    await db.run(session, db.get_chat_by_id, chat_id)
+
+    return StreamingResponse(
+        chat_event_stream(chat_id, last_event_id, session, broker),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+
+
+async def chat_event_stream(
+        chat_id: int,
+        last_event_id: Optional[int],
+        session: Session,
+        broker: Broker,
+        heartbeat_interval: float = sse_heartbeat_interval,
+) -> AsyncIterator[str]:
+    """
+    Yield the server-sent events of a chat.
+
+    The subscription is opened before the missed messages, those with an id
+    above last_event_id, are read from the database in id order, so nothing
+    created in between is lost; live messages that were
+    already sent from the database are skipped. Live messages are published
+    after their commits, which may finish out of id order, so every live
+    message newer than the replayed ones is sent, in the order it comes.
+    """
+    async with broker.subscribe(chat_topic(chat_id)) as subscription:
+        yield f"retry: {sse_retry_interval}\n\n"
+
+        replayed_up_to = last_event_id or 0
+        while last_event_id is not None:
+            messages = await db.run(
+                session, db.get_messages_after_id, chat_id, replayed_up_to,
+                limit=sse_backlog_page_size)
+            for message in messages:
+                data = MessageResponse(message=message).model_dump_json()
+                yield format_event(data, event_id=message.id, event="message")
+                replayed_up_to = message.id
+            if len(messages) < sse_backlog_page_size:
+                break
+        # don't hold a database connection for the lifetime of the stream
+        await db.close(session)
+
+        while True:
+            try:
+                response = await asyncio.wait_for(
+                    subscription.__anext__(), heartbeat_interval)
+            except asyncio.TimeoutError:
+                yield format_heartbeat()
+                continue
+            except StopAsyncIteration:
+                # dropped as a slow consumer; the client reconnects with Last-Event-ID
+                return
+
+            message_id = response["message"]["id"]
+            if message_id <= replayed_up_to:
+                continue
+            data = json.dumps(response, separators=(",", ":"))
+            yield format_event(data, event_id=message_id, event="message")
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Depends, Query
+from sqlmodel import Session
+
+from backend.auth import get_current_user
+from backend import database as db
+from backend.entities import MessageSearchResponse, UserInDB
+from backend.search import search_response
+
+search_router = APIRouter(prefix="/search", tags=["Search"])
+
+
+# GET /search/messages?q= searches the messages of every chat the current user is a member of, like
+# GET /chats/{chat_id}/messages/search does for a single chat. It requires a valid bearer token.
+@search_router.get("/messages", status_code=200, response_model=MessageSearchResponse)
+async def search_messages(
+        q: str = Query(min_length=1, max_length=200),
+        offset: int = Query(0, ge=0),
+        limit: int = Query(20, ge=1, le=100),
+        user: UserInDB = Depends(get_current_user),
+        session: Session = Depends(db.get_session)):
+    """
+
+    :param q: the words to search for
+    :param offset: number of results to skip
+    :param limit: maximum number of results in the page
+    :param user: the current user
+    :return: a page of matching messages
+    searches the messages of the current user's chats
+
+    """
+    results, next_offset = await db.run(
+        session, db.search_messages, query=q, user_id=user.id, offset=offset, limit=limit)
+    return search_response(results, next_offset)
@@ -1,49 +1,88 @@
-from fastapi import APIRouter, Depends
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query
 from sqlmodel import Session
 
 from backend.auth import AuthException, get_current_user
 from backend import database as db
 from backend.entities import *
+from backend.json_responses import json_response, render
+from backend.response_cache import USERS_TAG, response_cache, user_tag
 
 users_router = APIRouter(prefix="/users", tags=["Users"])
 
 
-# GET /users returns a list of users sorted by id alongside some metadata. The metadata has the count of users (
-# integer). The response has HTTP status code 200 and adheres to the following format:
-@users_router.get("", status_code=200, response_model=UserCollection)
-def get_users(session: Session = Depends(db.get_session)):
+# GET /users returns a page of users sorted by id alongside some metadata. `sort` (id, username or email) and `order`
+# (asc or desc) choose another order, `offset` and `limit` (at most 1000) select the page, `username_prefix` only
+# keeps users whose username starts with it, and `fields` (repeatable) only returns the given fields of each user. The
+# metadata has the count of users in the page (integer) and the offset of the next page, if any. The response has HTTP
+# status code 200 and adheres to the following format; it is rendered on the fast JSON path, see
+# backend/json_responses.py, and cached rendered.
+@users_router.get("", status_code=200, response_model=UserCollection, response_model_exclude_unset=True)
+async def get_users(
+        sort: str = "id",
+        order: str = "asc",
+        offset: int = Query(0, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        username_prefix: Optional[str] = None,
+        fields: List[str] = Query(None),
+        session: Session = Depends(db.get_session)):
     """
 
-    :return: a list of users
-    returns a list of users sorted by id with metadata
+    :param sort: the field to sort by
+    :param order: asc or desc
+    :param offset: number of users to skip
+    :param limit: maximum number of users in the page
+    :param username_prefix: only return users whose username starts with it
+    :param fields: only return these fields of each user
+    :return: a page of users
+    returns a page of users sorted by id with metadata
 
     """
-    users = db.get_all_users(session)
-    return UserCollection(
-        meta={"count": len(users)},
-        users=users,
-    )
+    async def load():
+        user_ids, users, next_offset = await db.run(
+            session, db.get_user_rows, sort=sort, order=order, offset=offset, limit=limit,
+            username_prefix=username_prefix, fields=fields)
+        tags = [USERS_TAG, *(user_tag(user_id) for user_id in user_ids)]
+        meta = OffsetMetadata(count=len(users), next_offset=next_offset)
+        return render({"meta": meta.model_dump(exclude_unset=True), "users": users}), tags
 
+    key = (sort, order, offset, limit, username_prefix, fields and tuple(fields))
+    return json_response(await response_cache.get_or_load("get_users", key, load))
 
-# GET /users/{user_id}/chats returns a list of chats for a given user id alongside some metadata.
+
+# GET /users/{user_id}/chats returns a list of chats for a given user id alongside some metadata, most recently active
+# first, or as chosen by `sort` (last_activity or name) and `order` (asc or desc). Each chat has its last message (if
+# any) and the number of messages the user has not read.
 @users_router.get(
     "/{user_id}/chats",
     status_code=200,
     response_model=ChatsForUserResponse,
     description="return list of chats for a given user id")
-def get_user_chats(user_id: int, session: Session = Depends(db.get_session)):
+async def get_user_chats(
+        user_id: int,
+        sort: str = "last_activity",
+        order: str = "desc",
+        session: Session = Depends(db.get_session)):
     """
     :param session:
     :param user_id: the user_id
+    :param sort: the field to sort by
+    :param order: asc or desc
     :return: a list of chats for user
     return list of chats for a given user id
     """
 
-    chats = db.get_chats_by_user_id(user_id, session)
+    summaries = await db.run(
+        session, db.get_chat_summaries_by_user_id, user_id, sort=sort, order=order)
 
     return ChatsForUserResponse(
-        meta={"count": len(chats)},
-        chats=sorted(chats, key=lambda chat: getattr(chat, "name")),
+        meta={"count": len(summaries)},
+        chats=[
+            ChatSummary.model_validate(
+                chat, update={"last_message": last_message, "unread_count": unread_count})
+            for chat, last_message, unread_count in summaries
+        ],
     )
 
 
@@ -52,14 +91,15 @@ def get_user_chats(user_id: int, session: Session = Depends(db.get_session)):
 
 
 @users_router.put("/me", status_code=200, response_model=UserResponse)
-def get_self(
+async def get_self(
     user_update: UserUpdate,
     user: UserInDB = Depends(get_current_user),
     session: Session = Depends(db.get_session)
 ):
     """update user."""
 
-    return UserResponse(user=db.update_user(session, user.id, user_update))
+    return UserResponse(user=await db.run(
+        session, db.update_user, user_id=user.id, user_update=user_update))
 
 # GET /users/me returns the current user. It requires a valid bearer token. If the token is valid, the response has
 # HTTP status code 200
@@ -69,7 +109,7 @@ def get_self(
     "/me",
     response_model=UserResponse,
     status_code=200)
-def get_self(user: UserInDB = Depends(get_current_user)):
+async def get_self(user: UserInDB = Depends(get_current_user)):
     """Get current user."""
     if user:
         return UserResponse(user=user)
@@ -86,7 +126,7 @@ def get_self(user: UserInDB = Depends(get_current_user)):
     status_code=200,
     response_model=UserResponse,
     description="get a user given a user_id")
-def get_user(user_id: int, session: Session = Depends(db.get_session)):
+async def get_user(user_id: int, session: Session = Depends(db.get_session)):
     """
 
     :param session:
@@ -95,4 +135,8 @@ def get_user(user_id: int, session: Session = Depends(db.get_session)):
     returns a user for a given id
 
     """
-    return UserResponse(user=db.get_user_by_id(user_id, session))
+    async def load():
+        user = await db.run(session, db.get_user_by_id, user_id)
+        return UserResponse(user=user), [user_tag(user.id)]
+
+    return await response_cache.get_or_load("get_user", (user_id,), load)
@@ -0,0 +1,182 @@
+"""Full-text search over messages.
+
+On SQLite, `messages_fts` is an FTS5 index of `messages.text`. It is an
+external content table, so the text is not stored twice, and triggers on
+`messages` keep it in sync with every insert, update and delete, including
+bulk inserts that bypass the ORM. On Postgres, a GIN index on
+`to_tsvector('english', text)` serves the same purpose and is maintained by
+Postgres itself. Both are created along with the messages table, and by a
+migration for existing databases; `rebuild_search_index` refills the FTS5
+index from scratch, and can be run with
+
+    python -m backend.search
+
+Queries are plain words: every word must match (after stemming), and the
+results are ranked by relevance, BM25 on SQLite and ts_rank on Postgres.
+"""
+import html
+import re
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Connection, column, event, func, literal_column, table
+from sqlalchemy.sql import Select
+from sqlmodel import select
+
+from backend.entities import MessageInDB, MessageSearchResponse, MessageSearchResult
+
+messages_table = MessageInDB.__table__
+
+# marks around the matched words in highlights; replaced by <mark> tags once
+# the text has been escaped
+highlight_start = "\x02"
+highlight_end = "\x03"
+highlight_words = 32
+
+sqlite_ddl = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        text, content='messages', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+]
+
+postgresql_ddl = [
+    """
+    CREATE INDEX IF NOT EXISTS ix_messages_text_search
+    ON messages USING gin (to_tsvector('english', text))
+    """,
+]
+
+messages_fts = table("messages_fts", column("rowid"))
+# the regconfig is inlined, not bound, so that the expression matches the index
+english = literal_column("'english'::regconfig")
+
+
+def create_search_index(connection: Connection):
+    """Create the full-text index of messages, if it does not exist yet."""
+    ddl = {"sqlite": sqlite_ddl, "postgresql": postgresql_ddl}.get(connection.dialect.name, [])
+    for statement in ddl:
+        connection.exec_driver_sql(statement)
+
+
+def rebuild_search_index(connection: Connection):
+    """Refill the FTS5 index from the messages table; Postgres needs nothing."""
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+@event.listens_for(messages_table, "after_create")
+def _create_search_index(target, connection: Connection, **kw):
+    create_search_index(connection)
+
+
+@event.listens_for(messages_table, "before_drop")
+def _drop_search_index(target, connection: Connection, **kw):
+    # the triggers and the Postgres index go with the messages table
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS messages_fts")
+
+
+def search_terms(query: str) -> list[str]:
+    """
+    Split a search query into its words.
+
+    :raises HTTPException: if the query has no words
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        raise HTTPException(status_code=422, detail={"type": "invalid_query", "query": query})
+    return terms
+
+
+def search_statement(dialect_name: str, query: str) -> Select:
+    """
+    Select the messages matching every word of query, most relevant first.
+
+    :param dialect_name: "sqlite" or "postgresql"
+    :param query: the words to search for
+    :return: a select of (message, score, highlight); a higher score is more
+        relevant, and the highlight is the raw text around the matches, see
+        `format_highlight`
+    """
+    terms = search_terms(query)
+    if dialect_name == "sqlite":
+        # quoted, so that words like AND or NEAR are not read as operators
+        match = " ".join(f'"{term}"' for term in terms)
+        bm25 = func.bm25(literal_column("messages_fts"))
+        return (
+            select(
+                MessageInDB,
+                (-bm25).label("score"),
+                func.snippet(literal_column("messages_fts"), 0, highlight_start, highlight_end,
+                             "…", highlight_words).label("highlight"),
+            )
+            .select_from(messages_fts)
+            .join(MessageInDB, MessageInDB.id == messages_fts.c.rowid)
+            .where(literal_column("messages_fts").op("MATCH")(match))
+            .order_by(bm25, MessageInDB.id.desc())
+        )
+
+    if dialect_name == "postgresql":
+        vector = func.to_tsvector(english, MessageInDB.text)
+        ts_query = func.plainto_tsquery(english, " ".join(terms))
+        score = func.ts_rank(vector, ts_query)
+        options = (f"StartSel={highlight_start}, StopSel={highlight_end}, "
+                   f"MaxWords={highlight_words}, MinWords={highlight_words // 2}")
+        return (
+            select(
+                MessageInDB,
+                score.label("score"),
+                func.ts_headline(english, MessageInDB.text, ts_query, options).label("highlight"),
+            )
+            .where(vector.op("@@")(ts_query))
+            .order_by(score.desc(), MessageInDB.id.desc())
+        )
+
+    raise HTTPException(status_code=501, detail={"type": "search_unavailable", "dialect": dialect_name})
+
+
+def format_highlight(highlight: str) -> str:
+    """Escape a highlight for HTML and wrap its matches in <mark> tags."""
+    return (html.escape(highlight)
+            .replace(highlight_start, "<mark>")
+            .replace(highlight_end, "</mark>"))
+
+
+def search_response(results: list[tuple[MessageInDB, float, str]], next_offset: Optional[int]) -> MessageSearchResponse:
+    """Build the response to a search from the results of `database.search_messages`."""
+    return MessageSearchResponse(
+        meta={"count": len(results), "next_offset": next_offset},
+        messages=[
+            MessageSearchResult.model_validate(
+                message, update={"score": score, "highlight": format_highlight(highlight)})
+            for message, score, highlight in results
+        ],
+    )
+
+
+if __name__ == "__main__":
+    from backend.database import engine
+
+    with engine.begin() as connection:
+        create_search_index(connection)
+        rebuild_search_index(connection)
+    print("rebuilt the message search index")
@@ -0,0 +1,54 @@
+"""
+Authentication overhead per request: decoding the bearer token and loading
+its user, with and without the claims and principal caches.
+
+    python -m benchmarks.auth_overhead --requests 20000
+"""
+import argparse
+import time
+
+from sqlmodel import Session, SQLModel
+
+from backend import auth
+from backend import database as db
+from backend.entities import UserInDB
+
+
+def measure(engine, token: str, requests: int, claims: bool, principals: bool) -> float:
+    claims_size, principal_size = auth.claims_cache.max_size, db.principal_cache.max_size
+    auth.claims_cache.max_size = claims_size if claims else 0
+    db.principal_cache.max_size = principal_size if principals else 0
+    auth.claims_cache.clear()
+    db.principal_cache.clear()
+    try:
+        start = time.perf_counter()
+        for _ in range(requests):
+            with Session(engine) as session:
+                auth._decode_access_token(session=session, token=token)
+        return 1e6 * (time.perf_counter() - start) / requests
+    finally:
+        auth.claims_cache.max_size = claims_size
+        db.principal_cache.max_size = principal_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    engine = db.create_db_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = UserInDB(username="bench", email="bench@example.com", hashed_password="x")
+        session.add(user)
+        session.commit()
+        token = auth._build_access_token(user).access_token
+
+    print(f"{'claims cache':>12} {'principal cache':>15} {'us/request':>10}")
+    for claims, principals in [(False, False), (True, False), (False, True), (True, True)]:
+        micros = measure(engine, token, args.requests, claims, principals)
+        print(f"{str(claims):>12} {str(principals):>15} {micros:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+JSON serialization benchmark: ORM and pydantic against the fast JSON path.
+
+Fills a scratch SQLite file with one chat of messages, then renders a page of
+1k, 10k and 100k of them both ways: the ORM path (`get_messages_page`, then
+the response model validated and serialized by FastAPI, as the route did) and
+the fast path (`get_message_rows` rendered with orjson, as the route does
+now). Reports the best time of a few runs and the peak memory allocated
+while rendering (traced separately, since tracing slows everything down),
+and checks that both paths produce the same bytes.
+
+    python -m benchmarks.json_serialization --sizes 1000 10000 100000 --repeat 5
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlmodel import Session, SQLModel
+
+from backend import database as db
+from backend.entities import ChatInDB, CursorMetadata, MessageInDB, MessagePage, UserInDB
+from backend.json_responses import render
+
+response_field = create_response_field(name="response", type_=MessagePage)
+
+
+def seed(engine, messages: int) -> int:
+    with Session(engine) as session:
+        users = [UserInDB(username=f"user{i}", email=f"user{i}@example.com", hashed_password="x")
+                 for i in range(10)]
+        chat = ChatInDB(name="bench", owner=users[0], users=users)
+        session.add(chat)
+        session.commit()
+        chat_id, user_ids = chat.id, [user.id for user in users]
+
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(MessageInDB.__table__.insert(), [
+            {
+                "text": f"message {i} about nothing in particular, just long enough to be typical",
+                "user_id": user_ids[i % len(user_ids)],
+                "chat_id": chat_id,
+                "created_at": start + timedelta(seconds=i, microseconds=i % 1000),
+            }
+            for i in range(messages)])
+    return chat_id
+
+
+def orm_path(engine, chat_id: int, limit: int) -> bytes:
+    with Session(engine) as session:
+        messages, next_cursor = db.get_messages_page(chat_id, session, limit=limit)
+        collection = MessagePage(
+            meta={"count": len(messages), "next_cursor": next_cursor},
+            messages=messages,
+        )
+        content = asyncio.run(serialize_response(
+            field=response_field, response_content=collection, is_coroutine=True))
+        return JSONResponse(content).body
+
+
+def fast_path(engine, chat_id: int, limit: int) -> bytes:
+    with Session(engine) as session:
+        messages, next_cursor = db.get_message_rows(chat_id, session, limit=limit)
+        meta = CursorMetadata(count=len(messages), next_cursor=next_cursor)
+        return render({"meta": meta.model_dump(), "messages": messages})
+
+
+def best_ms(path, engine, chat_id: int, limit: int, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        path(engine, chat_id, limit)
+        times.append(1000 * (time.perf_counter() - start))
+    return min(times)
+
+
+def peak_mib(path, engine, chat_id: int, limit: int) -> float:
+    tracemalloc.start()
+    try:
+        path(engine, chat_id, limit)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = db.create_db_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", pragmas=db.sqlite_pragmas)
+        SQLModel.metadata.create_all(engine)
+        chat_id = seed(engine, max(args.sizes))
+        try:
+            print(f"{'messages':>9} {'path':<5} {'best ms':>9} {'peak MiB':>9}")
+            for size in args.sizes:
+                if orm_path(engine, chat_id, size) != fast_path(engine, chat_id, size):
+                    raise SystemExit(f"the paths disagree on a page of {size} messages")
+                for name, path in [("orm", orm_path), ("fast", fast_path)]:
+                    ms = best_ms(path, engine, chat_id, size, args.repeat)
+                    print(f"{size:>9} {name:<5} {ms:>9.1f} {peak_mib(path, engine, chat_id, size):>9.1f}")
+        finally:
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Load benchmark comparing the sync and async database modes.
+
+Starts a uvicorn server for each DB_MODE against a scratch copy of the
+database, seeds it, then drives it with concurrent GET requests and reports
+requests per second and latency percentiles.
+
+    python -m benchmarks.load --concurrency 16 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def seed(workdir: Path, messages: int):
+    """Create and seed the scratch database the server will use."""
+    code = f"""
+from sqlmodel import Session
+from backend.database import create_db_and_tables, engine
+from backend.entities import ChatInDB, MessageInDB, UserInDB
+
+create_db_and_tables()
+with Session(engine) as session:
+    users = [UserInDB(username=f"user{{i}}", email=f"user{{i}}@example.com",
+                      hashed_password="x") for i in range(20)]
+    chat = ChatInDB(name="bench", owner=users[0], users=users)
+    session.add(chat)
+    session.commit()
+    session.add_all(MessageInDB(text=f"message {{i}}", user_id=users[i % 20].id,
+                                chat_id=chat.id) for i in range({messages}))
+    session.commit()
+"""
+    subprocess.run([sys.executable, "-c", code], cwd=workdir, env=_env("sync"),
+                   stdout=subprocess.DEVNULL, check=True)
+
+
+def _env(mode: str) -> dict:
+    return {**os.environ, "PYTHONPATH": str(ROOT), "DB_MODE": mode,
+            "PYTHONUNBUFFERED": "1"}
+
+
+async def drive(base_url: str, concurrency: int, duration: float) -> list[float]:
+    urls = ["/chats/1/messages?limit=50", "/chats/1/users", "/users/1", "/chats"]
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(n: int):
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+            i = n
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(urls[i % len(urls)])
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+                i += 1
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return latencies
+
+
+def bench_mode(mode: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        (workdir / "backend").mkdir()
+        shutil.copy(ROOT / "backend" / "fake_db.json", workdir / "backend")
+        seed(workdir, args.messages)
+
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app",
+             "--port", str(args.port), "--log-level", "warning",
+             "--no-access-log"],
+            cwd=workdir, env=_env(mode),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            for _ in range(100):
+                try:
+                    httpx.get(base_url + "/users/1")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            asyncio.run(drive(base_url, args.concurrency, 1))  # warm up
+            latencies = asyncio.run(
+                drive(base_url, args.concurrency, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": len(latencies),
+        "rps": len(latencies) / args.duration,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"])
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in args.modes:
+        result = bench_mode(mode, args)
+        print(f"{result['mode']:<6} {result['requests']:>9} {result['rps']:>9.1f} "
+              f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
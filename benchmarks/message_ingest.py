@@ -0,0 +1,76 @@
+"""
+Message ingestion benchmark: one POST per message against POST :batch.
+
+Posts the same number of messages to a chat in a scratch SQLite file through
+the app (in process, without a network hop), once per message with
+`POST /chats/{id}/messages` and in batches with `POST /chats/{id}/messages:batch`,
+and reports messages per second.
+
+    python -m benchmarks.message_ingest --messages 2000 --batch-size 500
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel
+
+from backend import database as db
+from backend.auth import _build_access_token
+from backend.entities import ChatInDB, UserInDB
+from backend.main import app
+
+
+def run(mode: str, args) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = db.create_db_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", pragmas=db.sqlite_pragmas)
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            user = UserInDB(username="bot", email="bot@example.com", hashed_password="x")
+            chat = ChatInDB(name="bench", owner=user, users=[user])
+            session.add(chat)
+            session.commit()
+            chat_id = chat.id
+            headers = {"Authorization": f"Bearer {_build_access_token(user).access_token}"}
+
+        def get_session():
+            with Session(engine) as session:
+                yield session
+
+        app.dependency_overrides[db.get_session] = get_session
+        texts = [{"text": f"message {i}"} for i in range(args.messages)]
+        # no lifespan, so the app's own database is not touched
+        client = TestClient(app)
+        try:
+            start = time.perf_counter()
+            if mode == "single":
+                for text in texts:
+                    client.post(f"/chats/{chat_id}/messages", json=text,
+                                headers=headers).raise_for_status()
+            else:
+                for i in range(0, len(texts), args.batch_size):
+                    client.post(f"/chats/{chat_id}/messages:batch",
+                                json=texts[i:i + args.batch_size],
+                                headers=headers).raise_for_status()
+            elapsed = time.perf_counter() - start
+        finally:
+            app.dependency_overrides.clear()
+            engine.dispose()
+
+    return args.messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'endpoint':<8} {'messages/s':>11}")
+    for mode in ["single", "batch"]:
+        print(f"{mode:<8} {run(mode, args):>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Message search benchmark: full-text search latency on a large corpus.
+
+Fills a scratch SQLite file with random messages (words drawn from a Zipf
+distribution over a fixed vocabulary, spread over many chats), then times
+`GET /chats/{id}/messages/search` and `GET /search/messages` through the app
+(in process, without a network hop) for words of decreasing frequency.
+
+    python -m benchmarks.message_search --messages 2000000 --requests 50
+"""
+import argparse
+import itertools
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel
+
+from backend import database as db
+from backend.auth import _build_access_token
+from backend.entities import ChatInDB, MessageInDB, UserChatLinkInDB, UserInDB
+from backend.main import app
+
+vocabulary = [f"{syllable}{i}" for i in range(2000) for syllable in ["ka", "lo", "mi", "ru", "te"]]
+
+
+def seed(engine, args) -> tuple[int, int, dict]:
+    rng = random.Random(0)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    with Session(engine) as session:
+        user = UserInDB(username="reader", email="reader@example.com", hashed_password="x")
+        session.add(user)
+        session.commit()
+        user_id = user.id
+
+    messages = MessageInDB.__table__
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(ChatInDB.__table__.insert(), [
+            {"id": i + 1, "name": f"chat {i}", "owner_id": user_id, "created_at": start}
+            for i in range(args.chats)])
+        connection.execute(UserChatLinkInDB.__table__.insert(), [
+            {"user_id": user_id, "chat_id": i + 1} for i in range(args.member_of)])
+        for offset in range(0, args.messages, 50_000):
+            connection.execute(messages.insert(), [
+                {
+                    "text": " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(4, 16))),
+                    "user_id": user_id,
+                    "chat_id": rng.randint(1, args.chats),
+                    "created_at": start + timedelta(seconds=offset + i),
+                }
+                for i in range(min(50_000, args.messages - offset))])
+
+    # by frequency rank of the words
+    queries = {
+        "common": vocabulary[0],
+        "frequent": vocabulary[20],
+        "uncommon": vocabulary[1000],
+        "rare": vocabulary[9000],
+        "two words": f"{vocabulary[0]} {vocabulary[50]}",
+    }
+    return user_id, 1, queries
+
+
+def timed(client: TestClient, url: str, params: dict, headers: dict, requests: int) -> list[float]:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(url, params=params, headers=headers).raise_for_status()
+        latencies.append(1000 * (time.perf_counter() - start))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--member-of", type=int, default=20,
+                        help="number of chats the searching user is a member of")
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = db.create_db_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", pragmas=db.sqlite_pragmas)
+        SQLModel.metadata.create_all(engine)
+        start = time.perf_counter()
+        user_id, chat_id, queries = seed(engine, args)
+        print(f"indexed {args.messages} messages in {time.perf_counter() - start:.0f} s")
+        with Session(engine) as session:
+            headers = {"Authorization": f"Bearer {_build_access_token(session.get(UserInDB, user_id)).access_token}"}
+
+        def get_session():
+            with Session(engine) as session:
+                yield session
+
+        app.dependency_overrides[db.get_session] = get_session
+        # no lifespan, so the app's own database is not touched
+        client = TestClient(app)
+        try:
+            print(f"{'endpoint':<13} {'query':<10} {'p50 ms':>8} {'p95 ms':>8}")
+            for endpoint, url in [("chat", f"/chats/{chat_id}/messages/search"), ("all chats", "/search/messages")]:
+                for name, q in queries.items():
+                    latencies = timed(client, url, {"q": q}, headers, args.requests)
+                    p95 = statistics.quantiles(latencies, n=20)[-1]
+                    print(f"{endpoint:<13} {name:<10} {statistics.median(latencies):>8.1f} {p95:>8.1f}")
+        finally:
+            app.dependency_overrides.clear()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+SQLite concurrency benchmark: N readers paging a chat while M writers post.
+
+Compares rollback journaling with full syncing (SQLite's defaults) against
+the tuned pragmas applied by `backend.database.sqlite_pragmas`.
+
+    python -m benchmarks.sqlite_concurrency --readers 8 --writers 2 --duration 5
+"""
+import argparse
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import exc
+from sqlmodel import Session, SQLModel
+
+from backend import database as db
+from backend.entities import ChatInDB, MessageInDB, UserInDB
+
+DEFAULT_PRAGMAS = {"busy_timeout": 5000, "journal_mode": "DELETE", "synchronous": "FULL"}
+
+
+def seed(engine, messages: int) -> tuple[int, int]:
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = UserInDB(username="writer", email="writer@example.com", hashed_password="x")
+        chat = ChatInDB(name="bench", owner=user, users=[user])
+        session.add(chat)
+        session.commit()
+        session.add_all(MessageInDB(text=f"message {i}", user_id=user.id, chat_id=chat.id)
+                        for i in range(messages))
+        session.commit()
+        return chat.id, user.id
+
+
+def run(pragmas: dict, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = db.create_db_engine(
+            f"sqlite:///{Path(tmp) / 'bench.db'}", pragmas=pragmas)
+        chat_id, user_id = seed(engine, args.messages)
+        counts = {"reads": 0, "writes": 0, "errors": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.duration
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def reader():
+            with Session(engine) as session:
+                while time.perf_counter() < deadline:
+                    db.get_messages_page(chat_id, session, limit=50)
+                    session.rollback()  # end the read transaction
+                    count("reads")
+
+        def writer():
+            with Session(engine) as session:
+                user = session.get(UserInDB, user_id)
+                while time.perf_counter() < deadline:
+                    try:
+                        db.create_message(session, chat_id, "hello", user)
+                        count("writes")
+                    except exc.OperationalError:
+                        session.rollback()
+                        count("errors")
+
+        threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+        threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    return {key: value / args.duration for key, value in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--messages", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print(f"{'pragmas':<8} {'reads/s':>9} {'writes/s':>9} {'errors/s':>9}")
+    for name, pragmas in [("default", DEFAULT_PRAGMAS), ("tuned", db.sqlite_pragmas)]:
+        result = run(pragmas, args)
+        print(f"{name:<8} {result['reads']:>9.1f} {result['writes']:>9.1f} "
+              f"{result['errors']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
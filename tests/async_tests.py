@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import database as db
+from backend.auth import _build_access_token
+from backend.entities import ChatInDB, MessageInDB, UserInDB
+from backend.main import app
+
+
+@pytest.fixture
+def async_client(tmp_path):
+    """Client whose requests run through an AsyncSession on aiosqlite."""
+    db_path = tmp_path / "pony_express.db"
+    engine = create_engine(f"sqlite:///{db_path}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = UserInDB(username="ripley", email="ripley@example.com",
+                        hashed_password="x")
+        chat = ChatInDB(name="nostromo", owner=user, users=[user])
+        session.add(chat)
+        session.commit()
+        session.add(MessageInDB(text="hello", user_id=user.id, chat_id=chat.id))
+        session.commit()
+
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+
+    async def _get_session_override():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
+    app.dependency_overrides[db.get_session] = _get_session_override
+
+    yield TestClient(app)
+
+    app.dependency_overrides.clear()
+
+
+def test_routes_in_async_mode(async_client):
+    registration = {"username": "bishop", "email": "bishop@example.com",
+                    "password": "android"}
+    response = async_client.post("/auth/registration", json=registration)
+    assert response.status_code == 201
+
+    response = async_client.post(
+        "/auth/token", data={"username": "bishop", "password": "android"})
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    assert async_client.get("/users/me", headers=headers).json()["user"]["username"] == "bishop"
+    response = async_client.put(
+        "/users/me", json={"email": "b@example.com"}, headers=headers)
+    assert response.json()["user"]["email"] == "b@example.com"
+
+    assert async_client.get("/users").json()["meta"]["count"] == 2
+    assert async_client.get("/users/1").status_code == 200
+    assert async_client.get("/users/1/chats").json()["meta"]["count"] == 1
+    assert async_client.get("/users/99").status_code == 404
+
+    assert async_client.get("/chats").json()["chats"][0]["owner"]["username"] == "ripley"
+    response = async_client.put("/chats/1", json={"name": "sulaco"})
+    assert response.json()["chat"]["name"] == "sulaco"
+    assert response.json()["chat"]["owner"]["username"] == "ripley"
+
+    response = async_client.post(
+        "/chats/1/messages", json={"text": "game over"}, headers=headers)
+    assert response.status_code == 201
+    assert response.json()["message"]["user"]["username"] == "bishop"
+
+    response = async_client.get("/chats/1?include=messages&include=users")
+    assert response.json()["meta"] == {"message_count": 2, "user_count": 1}
+    assert [m["text"] for m in response.json()["messages"]] == ["hello", "game over"]
+    assert async_client.get("/chats/1/messages").json()["meta"]["count"] == 2
+    assert async_client.get("/chats/1/users").json()["meta"]["count"] == 1
+    assert async_client.get("/chats/99").status_code == 404
+
+    # only members export a chat, and ripley is its only member
+    assert async_client.get("/chats/1/messages/export", headers=headers).status_code == 404
+    ripley = UserInDB(id=1, username="ripley", email="ripley@example.com", hashed_password="x")
+    headers = {"Authorization": f"Bearer {_build_access_token(ripley).access_token}"}
+    response = async_client.get("/chats/1/messages/export", headers=headers)
+    assert response.headers["content-encoding"] == "gzip"
+    assert [line["text"] for line in map(json.loads, response.text.splitlines())] == ["hello", "game over"]
+    response = async_client.get("/chats/1/messages/export?format=csv", headers=headers)
+    assert [row["text"] for row in csv.DictReader(io.StringIO(response.text))] == ["hello", "game over"]
@@ -0,0 +1,281 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from passlib.context import CryptContext
+from sqlmodel import Session, SQLModel, select
+
+from backend import auth
+from backend import database as db
+from backend.entities import RefreshTokenInDB, UserInDB
+from backend.main import app
+from backend.revocation import RevocationList
+from tests.conftest import capture_queries
+from backend.passwords import PasswordHasher, PasswordHashingOverloaded, get_password_hasher
+
+# cheap rounds keep the tests fast; hashes below 5 rounds count as outdated
+fast_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=5, bcrypt__min_rounds=5)
+outdated_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+
+
+@pytest.fixture
+def hasher(client):
+    hasher = PasswordHasher(context=fast_context, workers=1, max_pending=4)
+    app.dependency_overrides[get_password_hasher] = lambda: hasher
+    return hasher
+
+
+def _login(client, username, password):
+    return client.post("/auth/token", data={"username": username, "password": password})
+
+
+def test_register_and_login(client, hasher):
+    registration = {"username": "ripley", "email": "ripley@example.com", "password": "nostromo"}
+    response = client.post("/auth/registration", json=registration)
+    assert response.status_code == 201
+
+    response = _login(client, "ripley", "nostromo")
+    assert response.status_code == 200
+    assert response.json()["token_type"] == "Bearer"
+
+    assert _login(client, "ripley", "wrong").status_code == 401
+    assert _login(client, "nobody", "nostromo").status_code == 401
+
+
+def test_login_rehashes_outdated_password_hash(client, session, hasher):
+    user = UserInDB(username="ripley", email="ripley@example.com",
+                    hashed_password=outdated_context.hash("nostromo"))
+    session.add(user)
+    session.commit()
+    outdated_hash = user.hashed_password
+
+    assert _login(client, "ripley", "nostromo").status_code == 200
+
+    session.refresh(user)
+    assert user.hashed_password != outdated_hash
+    assert not fast_context.needs_update(user.hashed_password)
+    assert _login(client, "ripley", "nostromo").status_code == 200
+
+
+def test_password_checks_are_rejected_when_hasher_is_saturated(client, session, hasher):
+    session.add(UserInDB(username="ripley", email="ripley@example.com",
+                         hashed_password=fast_context.hash("nostromo")))
+    session.commit()
+    hasher.max_pending = 0
+
+    response = _login(client, "ripley", "nostromo")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["detail"]["error"] == "temporarily_unavailable"
+
+    registration = {"username": "bishop", "email": "bishop@example.com", "password": "x"}
+    assert client.post("/auth/registration", json=registration).status_code == 503
+
+
+def test_hasher_admits_at_most_max_pending_calls():
+    release = threading.Event()
+
+    class SlowContext:
+        def hash(self, password):
+            release.wait()
+            return password[::-1]
+
+    async def scenario():
+        hasher = PasswordHasher(context=SlowContext(), workers=1, max_pending=2)
+        pending = [asyncio.ensure_future(hasher.hash(p)) for p in ["ab", "cd"]]
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHashingOverloaded):
+            await hasher.hash("ef")
+        release.set()
+        assert await asyncio.gather(*pending) == ["ba", "dc"]
+        assert await hasher.hash("gh") == "hg"
+        assert hasher.rejected == 1
+
+    asyncio.run(scenario())
+
+
+def _register(client, session):
+    session.add(UserInDB(username="ripley", email="ripley@example.com",
+                         hashed_password=fast_context.hash("nostromo")))
+    session.commit()
+    return _login(client, "ripley", "nostromo").json()
+
+
+def _me(client, access_token):
+    return client.get("/users/me", headers={"Authorization": f"Bearer {access_token}"})
+
+
+def test_refresh_token_is_stored_hashed_and_rotated(client, session, hasher, monkeypatch):
+    tokens = _register(client, session)
+    stored = session.exec(select(RefreshTokenInDB)).one()
+    assert stored.token_hash != tokens["refresh_token"]
+
+    # renewal never verifies the password
+    monkeypatch.setattr(hasher, "verify_and_update", None)
+    response = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    renewed = response.json()
+    assert renewed["refresh_token"] != tokens["refresh_token"]
+    assert _me(client, renewed["access_token"]).status_code == 200
+
+    # the old refresh token was used up
+    response = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+    assert response.json()["detail"]["error"] == "invalid_grant"
+
+
+def test_expired_refresh_token_is_rejected(client, session, hasher):
+    tokens = _register(client, session)
+    stored = session.exec(select(RefreshTokenInDB)).one()
+    stored.expires_at = datetime.now() - timedelta(seconds=1)
+    session.add(stored)
+    session.commit()
+
+    response = client.post("/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+    assert session.exec(select(RefreshTokenInDB)).all() == []
+
+
+def test_concurrent_refreshes_use_the_token_once(tmp_path):
+    engine = db.create_db_engine(f"sqlite:///{tmp_path / 'auth.db'}", pragmas=db.sqlite_pragmas)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = UserInDB(username="ripley", email="ripley@example.com", hashed_password="x")
+        session.add(user)
+        session.commit()
+        refresh_token = auth._create_refresh_token(session, user_id=user.id)
+
+    barrier = threading.Barrier(8)
+    outcomes = []
+
+    def refresh():
+        with Session(engine) as session:
+            barrier.wait()
+            try:
+                auth._rotate_refresh_token(session, refresh_token=refresh_token)
+                outcomes.append("rotated")
+            except auth.InvalidRefreshToken:
+                outcomes.append("rejected")
+
+    threads = [threading.Thread(target=refresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    assert sorted(outcomes) == ["rejected"] * 7 + ["rotated"]
+
+
+def test_expired_refresh_tokens_are_pruned(client, session, hasher):
+    _register(client, session)
+    stored = session.exec(select(RefreshTokenInDB)).one()
+    stored.expires_at = datetime.now() - timedelta(seconds=1)
+    session.add(stored)
+    session.commit()
+
+    _login(client, "ripley", "nostromo")
+    session.expire_all()
+    (remaining,) = session.exec(select(RefreshTokenInDB)).all()
+    assert remaining.expires_at > datetime.now()
+
+
+def test_revoked_tokens_are_rejected_without_a_query_per_request(client, session, hasher):
+    tokens = _register(client, session)
+    other = _login(client, "ripley", "nostromo").json()
+    assert _me(client, tokens["access_token"]).status_code == 200
+
+    response = client.post(
+        "/auth/revoke", json={"refresh_token": tokens["refresh_token"]},
+        headers={"Authorization": f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 204
+
+    response = _me(client, tokens["access_token"])
+    assert response.status_code == 401
+    assert response.json()["detail"]["error_description"] == "revoked bearer token"
+    assert client.post(
+        "/auth/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+    # other tokens of the same user stay valid, and checking them reads no revocations
+    with capture_queries(session.get_bind()) as queries:
+        assert _me(client, other["access_token"]).status_code == 200
+    assert not any("revoked_tokens" in statement for statement, _ in queries)
+
+
+def test_revocation_list_syncs_revocations_from_other_workers(session):
+    clock = [0.0]
+    worker = RevocationList(sync_interval=5, clock=lambda: clock[0])
+    other_worker = RevocationList(sync_interval=5, clock=lambda: clock[0])
+    worker.sync_if_due(session)
+
+    other_worker.revoke(session, jti="abc", expires_at=int(time.time()) + 60)
+    other_worker.revoke(session, jti="old", expires_at=int(time.time()) - 1)
+    assert other_worker.is_revoked("abc")
+    assert not other_worker.is_revoked("old")
+
+    worker.sync_if_due(session)
+    assert not worker.is_revoked("abc")
+    clock[0] = 5
+    worker.sync_if_due(session)
+    assert worker.is_revoked("abc")
+    assert len(worker) == 1
+
+
+def test_duplicate_registration_is_reported_by_field(client, session, hasher, assert_num_queries):
+    registration = {"username": "ripley", "email": "ripley@example.com", "password": "nostromo"}
+    assert client.post("/auth/registration", json=registration).status_code == 201
+
+    # the failed insert, then one query to find the taken field
+    with assert_num_queries(2):
+        response = client.post("/auth/registration", json={**registration, "email": "other@example.com"})
+    assert response.status_code == 422
+    assert response.json()["detail"] == {
+        "type": "duplicate_value",
+        "entity_name": "User",
+        "entity_field": "username",
+        "entity_value": "ripley",
+    }
+
+    response = client.post("/auth/registration", json={**registration, "username": "ellen"})
+    assert response.status_code == 422
+    assert response.json()["detail"]["entity_field"] == "email"
+
+
+def test_bulk_registration_skips_duplicates(client, session, hasher, monkeypatch):
+    tokens = _register(client, session)
+    ripley = session.exec(select(UserInDB).where(UserInDB.username == "ripley")).one()
+    monkeypatch.setattr(auth, "admin_user_ids", {ripley.id})
+    monkeypatch.setattr(auth, "bulk_registration_batch_size", 3)
+    users = [{"username": f"user{i}", "email": f"user{i}@example.com"} for i in range(10)]
+    users[4]["username"] = "ripley"
+    users[7]["email"] = "user1@example.com"
+
+    with capture_queries(session.get_bind()) as queries:
+        response = client.post(
+            "/auth/registration/bulk", json={"users": users},
+            headers={"Authorization": f"Bearer {tokens['access_token']}"})
+
+    assert response.status_code == 200
+    assert response.json()["created"] == 8
+    assert [(d["entity_field"], d["entity_value"]) for d in response.json()["duplicates"]] == [
+        ("email", "user1@example.com"), ("username", "ripley")]
+    usernames = set(session.exec(select(UserInDB.username)).all())
+    assert usernames == {"ripley"} | {f"user{i}" for i in range(10) if i not in (4, 7)}
+    # three batches, the one with "ripley" retried without it
+    assert sum(statement.startswith("INSERT INTO users") for statement, _ in queries) == 4
+    # bulk users have no password to log in with
+    assert _login(client, "user0", "!").status_code == 401
+
+
+def test_bulk_registration_requires_a_token(client):
+    response = client.post("/auth/registration/bulk", json={"users": []})
+    assert response.status_code == 401
+
+
+def test_bulk_registration_requires_an_admin(client, session, hasher):
+    tokens = _register(client, session)
+    response = client.post("/auth/registration/bulk", json={"users": []},
+                           headers={"Authorization": f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 403
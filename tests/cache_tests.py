@@ -0,0 +1,134 @@
+import time
+
+import pytest
+from jose import ExpiredSignatureError, JWTError, jwt
+
+from backend import auth
+from backend import database as db
+from backend.auth import _build_access_token
+from backend.cache import TTLCache
+from backend.entities import UserInDB
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_expires_entries():
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=60, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=5)
+
+    clock.now = 10
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    clock.now = 61
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_refuses_values_loaded_before_an_invalidation():
+    cache = TTLCache(max_size=10, ttl=60)
+    generation = cache.generation
+    cache.invalidate("a")
+    cache.set("a", "stale", generation=generation)
+    assert cache.get("a") is None
+
+    cache.set("a", "fresh", generation=cache.generation)
+    assert cache.get("a") == "fresh"
+
+
+def test_ttl_cache_invalidates_tags():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1, tags=["x", "y"])
+    cache.set("b", 2, tags=["y"])
+    cache.invalidate_tags(["x"])
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+    # evicted entries leave no tags behind
+    cache.set("c", 3, tags=["z"])
+    cache.set("d", 4, tags=["z"])
+    assert cache._tagged == {"z": {"c", "d"}}
+
+
+def _auth_headers(session):
+    user = UserInDB(username="ripley", email="ripley@example.com", hashed_password="x")
+    session.add(user)
+    session.commit()
+    return {"Authorization": f"Bearer {_build_access_token(user).access_token}"}
+
+
+def test_authenticated_requests_skip_user_lookup(client, session, assert_num_queries):
+    headers = _auth_headers(session)
+    hits = db.principal_cache.hits
+
+    # the user, and the first sync of the revoked tokens
+    with assert_num_queries(2):
+        assert client.get("/users/me", headers=headers).status_code == 200
+    with assert_num_queries(0):
+        response = client.get("/users/me", headers=headers)
+
+    assert response.json()["user"]["username"] == "ripley"
+    assert db.principal_cache.hits == hits + 1
+
+
+def test_profile_update_is_seen_by_next_request(client, session):
+    headers = _auth_headers(session)
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    response = client.put("/users/me", json={"username": "ellen"}, headers=headers)
+    assert response.status_code == 200
+
+    session.expunge_all()
+    assert client.get("/users/me", headers=headers).json()["user"]["username"] == "ellen"
+
+
+def test_token_for_unknown_user_is_rejected(client):
+    token = _build_access_token(UserInDB(id=42, username="x", email="x", hashed_password="x"))
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {token.access_token}"})
+    assert response.status_code == 401
+
+
+def test_verified_claims_are_cached_until_token_expiry(monkeypatch):
+    token = _build_access_token(UserInDB(id=1, username="x", email="x", hashed_password="x"))
+    calls = []
+    decode = auth.jwt.decode
+    monkeypatch.setattr(auth.jwt, "decode", lambda *args, **kwargs: calls.append(1) or decode(*args, **kwargs))
+
+    first = auth._decode_claims(token.access_token)
+    second = auth._decode_claims(token.access_token)
+
+    assert first == second
+    assert len(calls) == 1
+    with pytest.raises(JWTError):
+        auth._decode_claims(token.access_token[:-2] + "xx")
+
+
+def test_expired_tokens_are_not_cached():
+    claims = auth.Claims(sub="1", exp=int(time.time()) - 1)
+    token = jwt.encode(claims.model_dump(), key=auth.jwt_key, algorithm=auth.jwt_alg)
+
+    with pytest.raises(ExpiredSignatureError):
+        auth._decode_claims(token)
+    assert auth.claims_cache.get(token) is None
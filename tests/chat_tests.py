@@ -1,5 +1,9 @@
+from datetime import datetime, timedelta
+
 from fastapi.testclient import TestClient
 
+from backend.auth import _build_access_token
+from backend.entities import MessageInDB
 from backend.main import app
 
 client = TestClient(app)
@@ -109,3 +113,89 @@ def test_delete_chat():
             "entity_id": chat_id,
         },
     }
+
+
+def _add_messages(session, chat, message_count):
+    created_at = datetime(2024, 1, 1)
+    for i in range(message_count):
+        # pairs of messages share a timestamp so ties are broken by id
+        session.add(MessageInDB(
+            text=f"message {i}", user_id=chat.owner_id, chat_id=chat.id,
+            created_at=created_at + timedelta(minutes=i // 2)))
+    session.commit()
+
+
+def test_get_chat_messages_pages_forward(client, session, chat):
+    _add_messages(session, chat, 7)
+    texts = []
+    cursor = None
+    while True:
+        params = {"limit": 3}
+        if cursor:
+            params["after"] = cursor
+        response = client.get(f"/chats/{chat.id}/messages", params=params)
+        assert response.status_code == 200
+        meta = response.json()["meta"]
+        messages = response.json()["messages"]
+        assert meta["count"] == len(messages)
+        texts += [message["text"] for message in messages]
+        cursor = meta["next_cursor"]
+        if cursor is None:
+            break
+
+    assert texts == [f"message {i}" for i in range(7)]
+
+
+def test_get_chat_messages_pages_backward(client, session, chat):
+    _add_messages(session, chat, 5)
+    response = client.get(f"/chats/{chat.id}/messages", params={"limit": 4})
+    cursor = response.json()["meta"]["next_cursor"]
+
+    pages = []
+    while cursor is not None:
+        response = client.get(
+            f"/chats/{chat.id}/messages",
+            params={"before": cursor, "limit": 2})
+        assert response.status_code == 200
+        pages.append([m["text"] for m in response.json()["messages"]])
+        cursor = response.json()["meta"]["next_cursor"]
+
+    assert pages == [["message 1", "message 2"], ["message 0"]]
+
+
+def test_get_chat_messages_invalid_cursor(client, session, chat):
+    _add_messages(session, chat, 1)
+    response = client.get(
+        f"/chats/{chat.id}/messages", params={"after": "not-a-cursor"})
+    assert response.status_code == 422
+    assert response.json()["detail"]["type"] == "invalid_cursor"
+
+
+def test_create_messages_in_batch(client, session, chat, assert_num_queries):
+    headers = {"Authorization": f"Bearer {_build_access_token(chat.owner).access_token}"}
+    texts = [{"text": f"bot message {i}"} for i in range(50)]
+
+    # the user, the revoked tokens, the chat, the insert, the chat counters,
+    # and the author again once the commit has expired it; none per message
+    with assert_num_queries(6):
+        response = client.post(f"/chats/{chat.id}/messages:batch", json=texts, headers=headers)
+
+    assert response.status_code == 201
+    messages = response.json()["messages"]
+    assert response.json()["meta"] == {"count": 50}
+    assert [m["text"] for m in messages] == [t["text"] for t in texts]
+    assert all(m["user"]["username"] == "ripley" for m in messages)
+
+    response = client.get(f"/chats/{chat.id}/messages", params={"limit": 1000})
+    assert response.json()["messages"] == messages
+
+
+def test_create_messages_in_batch_validation(client, session, chat):
+    headers = {"Authorization": f"Bearer {_build_access_token(chat.owner).access_token}"}
+
+    response = client.post("/chats/999/messages:batch", json=[{"text": "x"}], headers=headers)
+    assert response.status_code == 404
+    assert client.post(f"/chats/{chat.id}/messages:batch", json=[], headers=headers).status_code == 422
+    response = client.post(f"/chats/{chat.id}/messages:batch", json=[{"text": "x"}] * 1001, headers=headers)
+    assert response.status_code == 422
+    assert client.post(f"/chats/{chat.id}/messages:batch", json=[{"text": "x"}]).status_code == 401
@@ -1,22 +1,71 @@
+import os
+from contextlib import contextmanager
+
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlmodel import Session, SQLModel, StaticPool, create_engine
 
 from backend.main import app
 from backend import database as db
+from backend.cache import caches
+from backend.entities import ChatInDB, UserInDB
+from backend.revocation import revocations
 
 
-@pytest.fixture
-def session():
-    engine = create_engine(
-        "sqlite://",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
+@contextmanager
+def capture_queries(engine):
+    """Collect the (statement, parameters) of every SQL statement run on engine."""
+    queries = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        queries.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Each test starts with empty in-process caches (ids repeat across test databases)."""
+    for cache in caches.values():
+        cache.clear()
+    revocations.reset()
+    yield
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def session(request):
+    """
+    Session on an empty database, once per backend.
+
+    The postgresql run needs TEST_DATABASE_URL to point at a scratch database
+    (eg a local server or container); its tables are dropped after each test.
+    """
+    if request.param == "sqlite":
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+    else:
+        url = os.environ.get("TEST_DATABASE_URL")
+        if url is None:
+            pytest.skip("TEST_DATABASE_URL is not set")
+        engine = db.create_db_engine(url)
+        SQLModel.metadata.drop_all(engine)
+
     SQLModel.metadata.create_all(engine)
     with Session(engine) as session:
         yield session
 
+    if request.param != "sqlite":
+        SQLModel.metadata.drop_all(engine)
+    engine.dispose()
+
 
 @pytest.fixture
 def client(session):
@@ -28,3 +77,46 @@ def client(session):
     yield TestClient(app)
 
     app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def crew():
+    """Usernames of the members of the `chat` fixture, its owner first."""
+    return ["ripley", "dallas"]
+
+
+@pytest.fixture
+def chat(session, crew):
+    """
+    The chat "nostromo", owned by the first of `crew` and joined by the rest.
+
+    Modules needing other members override `crew`, or parametrize it:
+    `@pytest.mark.parametrize("crew", [["ripley"]])`. Modules needing
+    messages override `chat` with a fixture that requests it and adds them.
+    """
+    users = [UserInDB(username=username, email=f"{username}@example.com", hashed_password="x")
+             for username in crew]
+    chat = ChatInDB(name="nostromo", owner=users[0], users=users)
+    session.add(chat)
+    session.commit()
+    return chat
+
+
+@pytest.fixture
+def assert_num_queries(session):
+    """
+    Assert the number of SQL statements run inside a `with` block.
+
+    The identity map is cleared first, so objects left over from seeding the
+    test data cannot hide lazy loads.
+    """
+
+    @contextmanager
+    def _assert_num_queries(expected: int):
+        session.expunge_all()
+        with capture_queries(session.get_bind()) as queries:
+            yield queries
+        statements = "\n".join(statement for statement, _ in queries)
+        assert len(queries) == expected, statements
+
+    return _assert_num_queries
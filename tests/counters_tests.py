@@ -0,0 +1,86 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlmodel import Session, SQLModel
+
+from backend.auth import _build_access_token
+from backend.counters import reconcile_chat_counters
+from backend.entities import ChatInDB, MessageInDB, UserInDB
+from backend.migrations import run_migrations
+
+
+def _counters(session, chat):
+    session.refresh(chat)
+    return chat.message_count, chat.user_count, chat.last_message_at
+
+
+def test_counters_follow_orm_changes(session, chat):
+    assert _counters(session, chat) == (0, 2, None)
+
+    session.add(MessageInDB(text="a", user_id=chat.owner_id, chat_id=chat.id,
+                            created_at=datetime(2024, 1, 2)))
+    session.add(MessageInDB(text="b", user_id=chat.owner_id, chat=chat,
+                            created_at=datetime(2024, 1, 1)))
+    session.commit()
+    assert _counters(session, chat) == (2, 2, datetime(2024, 1, 2))
+
+    dallas = chat.users[1]
+    chat.users.remove(dallas)
+    session.commit()
+    assert _counters(session, chat)[1] == 1
+    dallas.chats.append(chat)
+    session.commit()
+    assert _counters(session, chat)[1] == 2
+
+    session.delete(session.get(MessageInDB, 1))
+    session.commit()
+    assert _counters(session, chat)[0] == 1
+
+
+def test_counters_follow_message_endpoints(client, session, chat):
+    headers = {"Authorization": f"Bearer {_build_access_token(chat.owner).access_token}"}
+    client.post(f"/chats/{chat.id}/messages", json={"text": "a"}, headers=headers)
+    client.post(f"/chats/{chat.id}/messages:batch", json=[{"text": "b"}, {"text": "c"}], headers=headers)
+
+    message_count, user_count, last_message_at = _counters(session, chat)
+    assert (message_count, user_count) == (3, 2)
+    assert last_message_at == max(m.created_at for m in chat.messages)
+
+    response = client.get(f"/chats/{chat.id}")
+    assert response.json()["meta"] == {"message_count": 3, "user_count": 2}
+
+
+def test_reconciliation_repairs_drift(session, chat):
+    session.add(MessageInDB(text="a", user_id=chat.owner_id, chat_id=chat.id,
+                            created_at=datetime(2024, 1, 1)))
+    session.commit()
+    assert reconcile_chat_counters(session) == 0
+
+    session.exec(ChatInDB.__table__.update().values(message_count=7, last_message_at=None))
+    session.commit()
+
+    assert reconcile_chat_counters(session) == 1
+    session.commit()
+    assert _counters(session, chat) == (1, 2, datetime(2024, 1, 1))
+
+
+def test_migration_adds_and_backfills_counters():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        owner = UserInDB(username="ripley", email="ripley@example.com", hashed_password="x")
+        chat = ChatInDB(name="nostromo", owner=owner, users=[owner])
+        session.add(chat)
+        session.commit()
+        session.add(MessageInDB(text="a", user_id=owner.id, chat_id=chat.id))
+        session.commit()
+    with engine.begin() as connection:
+        for column in ["message_count", "user_count", "last_message_at"]:
+            connection.exec_driver_sql(f"ALTER TABLE chats DROP COLUMN {column}")
+
+    run_migrations(engine)
+
+    with Session(engine) as session:
+        chat = session.get(ChatInDB, 1)
+        assert (chat.message_count, chat.user_count) == (1, 1)
+        assert chat.last_message_at is not None
@@ -0,0 +1,125 @@
+from datetime import datetime
+
+import pytest
+
+from backend.auth import _build_access_token
+from backend.counters import reconcile_chat_counters
+from backend.entities import ChatInDB, MessageInDB, UserInDB
+from backend.etags import etag_matches
+
+urls = ["/chats/{chat_id}", "/chats/{chat_id}/messages", "/chats/{chat_id}/users"]
+
+
+@pytest.fixture
+def chat(chat, session):
+    dallas = chat.users[1]
+    session.add(MessageInDB(text="hello", user_id=dallas.id, chat_id=chat.id,
+                            created_at=datetime(2024, 1, 1)))
+    session.commit()
+    return chat
+
+
+def _etags(client, chat_id):
+    return [client.get(url.format(chat_id=chat_id)).headers["ETag"] for url in urls]
+
+
+@pytest.mark.parametrize("url, cache_control", [
+    ("/chats/{chat_id}", "private, no-cache"),
+    ("/chats/{chat_id}/messages", "private, no-cache"),
+    ("/chats/{chat_id}/users", "private, max-age=10"),
+])
+def test_chat_responses_are_conditional(client, chat, assert_num_queries, url, cache_control):
+    url = url.format(chat_id=chat.id)
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert response.headers["Cache-Control"] == cache_control
+
+    # a poll that finds nothing new is one primary key lookup and no body
+    with assert_num_queries(1):
+        response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    assert response.headers["Cache-Control"] == cache_control
+
+    response = client.get(url, headers={"If-None-Match": 'W/"chat-0-0"'})
+    assert response.status_code == 200
+
+
+def test_unknown_chat_is_not_found(client, chat):
+    response = client.get("/chats/999/messages", headers={"If-None-Match": "*"})
+    assert response.status_code == 404
+
+
+def test_etag_changes_with_new_messages(client, session, chat):
+    headers = {"Authorization": f"Bearer {_build_access_token(chat.owner).access_token}"}
+    before = _etags(client, chat.id)
+    client.post(f"/chats/{chat.id}/messages", json={"text": "a"}, headers=headers)
+    after_single = _etags(client, chat.id)
+    client.post(f"/chats/{chat.id}/messages:batch", json=[{"text": "b"}], headers=headers)
+    after_batch = _etags(client, chat.id)
+
+    assert len({before[0], after_single[0], after_batch[0]}) == 3
+
+
+def test_etag_changes_when_counters_are_repaired(client, session, chat):
+    etag = client.get(f"/chats/{chat.id}").headers["ETag"]
+    # a delete behind the ORM's back leaves the counters stale
+    session.execute(MessageInDB.__table__.delete())
+    session.commit()
+    reconcile_chat_counters(session)
+    session.commit()
+
+    response = client.get(f"/chats/{chat.id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["meta"]["message_count"] == 0
+
+
+def test_etag_changes_with_chat_and_membership_changes(client, session, chat):
+    etags = [_etags(client, chat.id)[0]]
+
+    client.put(f"/chats/{chat.id}", json={"name": "sulaco"})
+    etags.append(_etags(client, chat.id)[0])
+
+    # swapping a member keeps the member count
+    kane = UserInDB(username="kane", email="kane@example.com", hashed_password="x")
+    chat.users = [chat.users[0], kane]
+    session.commit()
+    etags.append(_etags(client, chat.id)[0])
+
+    session.delete(session.get(MessageInDB, 1))
+    session.commit()
+    etags.append(_etags(client, chat.id)[0])
+
+    assert len(set(etags)) == len(etags)
+
+
+@pytest.mark.parametrize("member", [0, 1])
+def test_etag_changes_when_a_user_shown_in_the_chat_is_renamed(client, session, chat, member):
+    user = chat.users[member]
+    other = ChatInDB(name="other", owner=UserInDB(username="x", email="x@example.com", hashed_password="x"))
+    session.add(other)
+    session.commit()
+    before = _etags(client, chat.id)
+    other_before = _etags(client, other.id)
+
+    headers = {"Authorization": f"Bearer {_build_access_token(user).access_token}"}
+    assert client.put("/users/me", json={"username": "renamed"}, headers=headers).status_code == 200
+
+    assert _etags(client, chat.id)[0] != before[0]
+    assert _etags(client, other.id) == other_before
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('W/"chat-1-2"', True),
+    ('"chat-1-2"', True),
+    ('W/"chat-1-1", W/"chat-1-2"', True),
+    ("*", True),
+    ('W/"chat-1-3"', False),
+    (None, False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, 'W/"chat-1-2"') is expected
@@ -0,0 +1,136 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import database as db
+from backend.auth import _build_access_token
+from backend.entities import MessageInDB, UserInDB
+from backend.export import accepts_gzip, export_batch_size
+
+texts = ["hello", "commas, \"quotes\"\nand a newline", "ça va 🚀", ""]
+
+
+@pytest.fixture
+def chat(chat, session):
+    ripley, dallas = chat.users
+    # more than two batches, inserted out of order
+    start = datetime(2024, 1, 1)
+    count = 2 * export_batch_size + 5
+    session.execute(MessageInDB.__table__.insert(), [
+        {"text": texts[i % len(texts)], "user_id": [ripley, dallas][i % 2].id, "chat_id": chat.id,
+         "created_at": start + timedelta(seconds=count - i, microseconds=i % 7)}
+        for i in range(count)])
+    session.commit()
+    return chat
+
+
+def _headers(user, accept_encoding="identity"):
+    return {"Authorization": f"Bearer {_build_access_token(user).access_token}",
+            "Accept-Encoding": accept_encoding}
+
+
+def _all_messages(client, chat_id):
+    messages, cursor = [], None
+    while True:
+        page = client.get(f"/chats/{chat_id}/messages",
+                          params={"limit": 1000, **({"after": cursor} if cursor else {})}).json()
+        messages += page["messages"]
+        cursor = page["meta"]["next_cursor"]
+        if cursor is None:
+            return messages
+
+
+def test_ndjson_export_has_every_message(client, chat):
+    response = client.get(f"/chats/{chat.id}/messages/export", headers=_headers(chat.owner))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-disposition"] == f'attachment; filename="chat-{chat.id}-messages.ndjson"'
+
+    lines = response.content.split(b"\n")
+    assert lines[-1] == b""
+    assert [json.loads(line) for line in lines[:-1]] == _all_messages(client, chat.id)
+
+
+def test_csv_export_has_every_message(client, chat):
+    response = client.get(f"/chats/{chat.id}/messages/export", params={"format": "csv"}, headers=_headers(chat.owner))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert rows == [
+        {
+            "id": str(message["id"]),
+            "chat_id": str(message["chat_id"]),
+            "created_at": message["created_at"],
+            "user_id": str(message["user"]["id"]),
+            "username": message["user"]["username"],
+            "email": message["user"]["email"],
+            "text": message["text"],
+        }
+        for message in _all_messages(client, chat.id)
+    ]
+
+
+def test_export_is_gzipped_when_accepted(client, chat):
+    url = f"/chats/{chat.id}/messages/export"
+    plain = client.get(url, headers=_headers(chat.owner))
+    with client.stream("GET", url, headers=_headers(chat.owner, "gzip")) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        compressed = b"".join(response.iter_raw())
+    assert gzip.decompress(compressed) == plain.content
+    assert len(compressed) < len(plain.content) / 4
+
+
+def test_export_errors(client, chat):
+    headers = _headers(chat.owner)
+    assert client.get("/chats/999/messages/export", headers=headers).status_code == 404
+    response = client.get(f"/chats/{chat.id}/messages/export", params={"format": "xml"}, headers=headers)
+    assert response.status_code == 422
+    assert response.json()["detail"]["type"] == "invalid_format"
+
+
+def test_export_requires_a_member(client, session, chat):
+    url = f"/chats/{chat.id}/messages/export"
+    assert client.get(url).status_code == 401
+    outsider = UserInDB(username="burke", email="burke@example.com", hashed_password="x")
+    session.add(outsider)
+    session.commit()
+    # as if the chat did not exist
+    assert client.get(url, headers=_headers(outsider)).status_code == 404
+    assert client.get(url, headers=_headers(chat.users[1])).status_code == 200
+
+
+def test_stream_reads_batches_without_loading_objects(session, chat):
+    chat_id, user_id = chat.id, chat.owner_id
+    session.expunge_all()
+    stmt = db.message_export_statement(chat_id, user_id, session)
+
+    async def batch_sizes():
+        return [len(batch) async for batch in db.stream(session, stmt, 100)]
+
+    sizes = asyncio.run(batch_sizes())
+    assert sum(sizes) == 2 * export_batch_size + 5
+    assert all(size == 100 for size in sizes[:-1])
+    assert not any(isinstance(obj, (MessageInDB, UserInDB)) for obj in session.identity_map.values())
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("gzip", True),
+    ("gzip, deflate, br", True),
+    ("deflate", False),
+    ("gzip;q=0", False),
+    ("gzip; q=0.5", True),
+    ("*", True),
+    ("*, gzip;q=0", False),
+    ("identity", False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
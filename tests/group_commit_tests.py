@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+
+from backend import auth
+from backend.auth import _build_access_token
+from backend.entities import MessageInDB
+from backend.group_commit import MessageWriter, get_message_writer
+from backend.main import app
+
+
+@pytest.fixture
+def writer(session):
+    writer = MessageWriter(session.get_bind(), interval_ms=50, max_batch=100)
+    yield writer
+    writer.close()
+
+
+def _write_all(writer, chat, texts):
+    async def scenario():
+        return await asyncio.gather(
+            *(writer.write(chat_id=chat.id, text=text, user=chat.owner) for text in texts),
+            return_exceptions=True)
+
+    return asyncio.run(scenario())
+
+
+def test_concurrent_messages_share_a_commit(session, chat, writer):
+    messages = _write_all(writer, chat, [f"message {i}" for i in range(10)])
+
+    assert [m.text for m in messages] == [f"message {i}" for i in range(10)]
+    assert [m.id for m in messages] == sorted({m.id for m in messages})
+    assert writer.flush_size.snapshot()["count"] == 1
+    assert writer.flush_size.snapshot()["sum"] == 10
+    assert writer.wait_ms.count == 10
+
+    stored = session.exec(select(MessageInDB.id, MessageInDB.text).order_by(MessageInDB.id)).all()
+    assert [(m.id, m.text) for m in messages] == [tuple(row) for row in stored]
+    session.refresh(chat)
+    assert chat.message_count == 10
+    assert chat.last_message_at == max(m.created_at for m in messages)
+
+
+def test_flush_is_triggered_by_batch_size(session, chat):
+    writer = MessageWriter(session.get_bind(), interval_ms=60_000, max_batch=4)
+    try:
+        _write_all(writer, chat, [f"message {i}" for i in range(8)])
+    finally:
+        writer.close()
+
+    assert writer.flush_size.snapshot()["buckets"]["5"] == 2
+
+
+def test_failed_message_does_not_fail_its_group(session, chat, writer):
+    results = _write_all(writer, chat, ["first", None, "third"])
+
+    assert [m.text for m in (results[0], results[2])] == ["first", "third"]
+    assert isinstance(results[1], IntegrityError)
+    assert session.exec(select(MessageInDB.text).order_by(MessageInDB.id)).all() == ["first", "third"]
+
+
+def test_create_message_with_group_commit(client, session, chat, writer, monkeypatch):
+    app.dependency_overrides[get_message_writer] = lambda: writer
+    headers = {"Authorization": f"Bearer {_build_access_token(chat.owner).access_token}"}
+
+    response = client.post(f"/chats/{chat.id}/messages", json={"text": "hello"}, headers=headers)
+    assert response.status_code == 201
+    message = response.json()["message"]
+    assert session.get(MessageInDB, message["id"]).text == "hello"
+
+    response = client.post("/chats/999/messages", json={"text": "hello"}, headers=headers)
+    assert response.status_code == 404
+
+    monkeypatch.setattr(auth, "admin_user_ids", {chat.owner_id})
+    stats = client.get("/admin/group-commit", headers=headers).json()
+    assert stats["enabled"]
+    assert stats["flush_size"]["count"] == 1
+    assert stats["wait_ms"]["count"] == 1
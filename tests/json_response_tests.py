@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pytest
+
+from backend import database as db
+from backend.entities import (
+    MessageInDB, MessagePage, OffsetMetadata, UserCollection, UserFields, UserInDB,
+)
+
+
+@pytest.fixture
+def chat(chat, session):
+    ripley, dallas = chat.users
+    ripley.created_at = datetime(2024, 1, 1)
+    dallas.created_at = datetime(2024, 1, 1, 12, 30, 15, 250)
+    texts = ["hello", "ça va? \"quoted\" \\ <tag> 🚀", "", "line\nbreak"]
+    session.add_all(
+        MessageInDB(text=text, user_id=[ripley, dallas][i % 2].id, chat_id=chat.id,
+                    created_at=datetime(2024, 1, 2, 0, 0, i, 123456 * (i % 2)))
+        for i, text in enumerate(texts))
+    session.commit()
+    return chat
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"order": "desc"},
+    {"limit": 3},
+    {"limit": 3, "order": "desc"},
+])
+def test_messages_match_the_response_model(client, session, chat, params):
+    response = client.get(f"/chats/{chat.id}/messages", params=params)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+
+    # what the route returned when FastAPI serialized the model
+    messages, next_cursor = db.get_messages_page(chat.id, session, **params)
+    expected = MessagePage(
+        meta={"count": len(messages), "next_cursor": next_cursor},
+        messages=messages,
+    )
+    assert response.content == expected.model_dump_json().encode()
+
+
+def test_message_cursors_match(client, session, chat):
+    first = client.get(f"/chats/{chat.id}/messages", params={"limit": 2}).json()
+    rest = client.get(f"/chats/{chat.id}/messages", params={"after": first["meta"]["next_cursor"]}).json()
+    assert [m["text"] for m in first["messages"] + rest["messages"]] == [
+        "hello", "ça va? \"quoted\" \\ <tag> 🚀", "", "line\nbreak"]
+
+
+def test_message_rows_skip_the_identity_map(session, chat):
+    chat_id = chat.id
+    session.expunge_all()
+    messages, _ = db.get_message_rows(chat_id, session)
+    assert len(messages) == 4
+    assert not any(isinstance(obj, (MessageInDB, UserInDB)) for obj in session.identity_map.values())
+
+
+@pytest.mark.parametrize("fields", [None, ["username"], ["email", "id"], ["created_at", "username", "username"]])
+def test_users_match_the_response_model(client, session, chat, fields):
+    response = client.get("/users", params={"limit": 1, "fields": fields or []})
+    assert response.status_code == 200
+
+    users = [session.get(UserInDB, chat.owner_id)]
+    if fields is not None:
+        users = [UserFields(**{field: getattr(user, field) for field in fields}) for user in users]
+    expected = UserCollection(meta=OffsetMetadata(count=1, next_offset=1), users=users)
+    assert response.content == expected.model_dump_json(exclude_unset=True).encode()
+
+
+def test_cached_users_are_served_rendered(client, chat):
+    first = client.get("/users")
+    second = client.get("/users")
+    assert second.content == first.content
+    assert second.headers["content-type"] == "application/json"
+
+
+def test_meta_has_only_the_paging_fields_of_its_route(client, session, chat):
+    assert client.get(f"/chats/{chat.id}/messages").json()["meta"] == {"count": 4, "next_cursor": None}
+    assert client.get(f"/chats/{chat.id}/users").json()["meta"] == {"count": 2}
+    assert client.get(f"/users/{chat.owner_id}/chats").json()["meta"] == {"count": 1}
+    search = client.get(f"/chats/{chat.id}/messages/search", params={"q": "hello"}).json()
+    assert set(search["meta"]) == {"count", "next_offset"}
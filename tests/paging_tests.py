@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import pytest
+
+from backend.entities import ChatInDB, UserInDB
+from tests.conftest import capture_queries
+
+
+@pytest.fixture
+def seeded(session):
+    names = ["ash", "bishop", "burke", "dallas", "drake", "hicks", "hudson", "ripley", "b_x", "bzz"]
+    users = [UserInDB(username=name, email=f"{name}@example.com", hashed_password="x") for name in names]
+    chats = [ChatInDB(name=name, owner=users[0], created_at=datetime(2024, 1, 1))
+             for name in ["nostromo", "narcissus", "sulaco", "n%", "bridge"]]
+    session.add_all(users + chats)
+    session.commit()
+    return users, chats
+
+
+def _page_through(client, url, key, **params):
+    items, offset = [], 0
+    while offset is not None:
+        response = client.get(url, params={**params, "offset": offset})
+        assert response.status_code == 200
+        meta = response.json()["meta"]
+        page = response.json()[key]
+        assert meta["count"] == len(page) <= params["limit"]
+        items += page
+        offset = meta["next_offset"]
+    return items
+
+
+def test_users_are_paged(client, seeded):
+    users = _page_through(client, "/users", "users", limit=3)
+    assert [user["username"] for user in users] == [user.username for user in seeded[0]]
+
+
+def test_chats_are_paged(client, seeded):
+    chats = _page_through(client, "/chats", "chats", limit=2, sort="id")
+    assert [chat["name"] for chat in chats] == [chat.name for chat in seeded[1]]
+
+
+@pytest.mark.parametrize("url", ["/users", "/chats"])
+@pytest.mark.parametrize("params", [{"limit": 0}, {"limit": 1001}, {"offset": -1}])
+def test_page_size_is_bounded(client, url, params):
+    assert client.get(url, params=params).status_code == 422
+
+
+def test_users_default_to_a_bounded_page(client, session):
+    session.add_all(UserInDB(username=f"user{i:03}", email=f"user{i}@example.com", hashed_password="x")
+                    for i in range(150))
+    session.commit()
+
+    response = client.get("/users")
+    assert response.json()["meta"] == {"count": 100, "next_offset": 100}
+
+
+@pytest.mark.parametrize("prefix, expected", [
+    ("b", ["bishop", "burke", "b_x", "bzz"]),
+    ("bu", ["burke"]),
+    ("b_", ["b_x"]),
+    ("z", []),
+])
+def test_users_are_filtered_by_username_prefix(client, seeded, prefix, expected):
+    response = client.get("/users", params={"username_prefix": prefix})
+    assert response.status_code == 200
+    assert [user["username"] for user in response.json()["users"]] == expected
+
+
+@pytest.mark.parametrize("prefix, expected", [
+    ("n", ["n%", "narcissus", "nostromo"]),
+    ("n%", ["n%"]),
+    ("N", []),
+])
+def test_chats_are_filtered_by_name_prefix(client, seeded, prefix, expected):
+    response = client.get("/chats", params={"name_prefix": prefix})
+    assert response.status_code == 200
+    assert [chat["name"] for chat in response.json()["chats"]] == expected
+
+
+def test_users_fields_projection(client, session, seeded):
+    with capture_queries(session.get_bind()) as queries:
+        response = client.get("/users", params={"fields": ["username"], "limit": 2})
+
+    assert response.status_code == 200
+    assert response.json()["users"] == [{"username": "ash"}, {"username": "bishop"}]
+    select = next(statement for statement, _ in queries if "FROM users" in statement)
+    assert "email" not in select and "created_at" not in select
+
+
+def test_chats_fields_projection(client, session, seeded):
+    with capture_queries(session.get_bind()) as queries:
+        response = client.get("/chats", params={"fields": ["id", "name"], "limit": 1})
+
+    assert response.status_code == 200
+    assert response.json()["chats"] == [{"id": seeded[1][4].id, "name": "bridge"}]
+    assert not any("users" in statement for statement, _ in queries)
+
+    response = client.get("/chats", params={"fields": ["owner"], "limit": 1})
+    assert response.json()["chats"] == [{"owner": {
+        "id": seeded[0][0].id,
+        "username": "ash",
+        "email": "ash@example.com",
+        "created_at": seeded[0][0].created_at.isoformat(),
+    }}]
+
+
+@pytest.mark.parametrize("url", ["/users", "/chats"])
+def test_unknown_fields_are_rejected(client, url):
+    response = client.get(url, params={"fields": ["id", "hashed_password"]})
+    assert response.status_code == 422
+    assert response.json()["detail"]["type"] == "invalid_fields"
@@ -0,0 +1,105 @@
+import json
+import logging
+
+from sqlmodel import create_engine
+
+from backend import auth
+from backend.auth import _build_access_token
+from backend.entities import UserInDB
+from backend.query_log import QueryLog, normalize_statement, query_log
+
+
+def test_normalize_statement():
+    assert normalize_statement(
+        "SELECT *\n  FROM users WHERE users.id IN (?, ?, ?) AND name = 'x' LIMIT 10"
+    ) == "SELECT * FROM users WHERE users.id IN (?) AND name = ? LIMIT ?"
+    assert normalize_statement("SELECT 1 WHERE id IN (?)") == \
+        normalize_statement("SELECT 1 WHERE id IN (?, ?)")
+
+
+def test_slow_queries_are_logged_and_aggregated(caplog):
+    engine = create_engine("sqlite://")
+    log = QueryLog(sample_rate=0, slow_ms=0)
+    log.install(engine)
+
+    with caplog.at_level(logging.INFO, logger="backend.query"):
+        with engine.connect() as connection:
+            for i in range(3):
+                connection.exec_driver_sql(f"SELECT {i}")
+            connection.exec_driver_sql("SELECT 'a', 'b'")
+
+    records = [json.loads(record.message) for record in caplog.records]
+    assert len(records) == 4
+    assert set(records[0]) == {"fingerprint", "statement", "duration_ms", "row_count", "slow"}
+
+    slow = {entry["statement"]: entry for entry in log.slow_queries()}
+    assert slow["SELECT ?"]["count"] == 3
+    assert slow["SELECT ?, ?"]["count"] == 1
+    assert slow["SELECT ?"]["max_ms"] >= slow["SELECT ?"]["avg_ms"]
+
+
+def test_row_counts_are_recorded_where_the_driver_knows_them(caplog):
+    engine = create_engine("sqlite://")
+    log = QueryLog(sample_rate=0, slow_ms=0)
+    log.install(engine)
+
+    with caplog.at_level(logging.INFO, logger="backend.query"):
+        with engine.begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE t (a INTEGER)")
+            connection.exec_driver_sql("INSERT INTO t VALUES (1), (2), (3)")
+            connection.exec_driver_sql("UPDATE t SET a = a + 1 WHERE a > 1")
+            connection.exec_driver_sql("SELECT a FROM t")
+
+    row_counts = {record["statement"]: record["row_count"]
+                  for record in map(json.loads, (record.message for record in caplog.records))}
+    assert row_counts["INSERT INTO t VALUES (?), (?), (?)"] == 3
+    assert row_counts["UPDATE t SET a = a + ? WHERE a > ?"] == 2
+    # sqlite3 does not count the rows of a SELECT before they are fetched
+    assert row_counts["SELECT a FROM t"] is None
+
+
+def test_fast_unsampled_queries_are_not_logged(caplog):
+    engine = create_engine("sqlite://")
+    log = QueryLog(sample_rate=0, slow_ms=10_000)
+    log.install(engine)
+
+    with caplog.at_level(logging.INFO, logger="backend.query"):
+        with engine.connect() as connection:
+            connection.exec_driver_sql("SELECT 1")
+
+    assert caplog.records == []
+    assert log.slow_queries() == []
+    assert not QueryLog(sample_rate=0, slow_ms=None).enabled
+
+
+def test_slow_query_table_is_bounded():
+    log = QueryLog(sample_rate=0, slow_ms=0, table_size=2)
+    log.record("SELECT a FROM t", 5, None, is_slow=True)
+    log.record("SELECT b FROM t", 1, None, is_slow=True)
+    log.record("SELECT c FROM t", 3, None, is_slow=True)
+    log.record("SELECT d FROM t", 0.5, None, is_slow=True)
+
+    assert [entry["statement"] for entry in log.slow_queries()] == [
+        "SELECT a FROM t", "SELECT c FROM t"]
+
+
+def test_admin_slow_queries(client, session, monkeypatch):
+    user = UserInDB(username="ripley", email="ripley@example.com", hashed_password="x")
+    session.add(user)
+    session.commit()
+    query_log.record("SELECT a FROM t", 5, 1, is_slow=True)
+    headers = {"Authorization": f"Bearer {_build_access_token(user).access_token}"}
+
+    try:
+        # SQL text is for admins only
+        assert client.get("/admin/slow-queries", headers=headers).status_code == 403
+        # rights go with the user, not with a username anyone could register
+        monkeypatch.setattr(auth, "admin_user_ids", {user.id + 1})
+        assert client.get("/admin/slow-queries", headers=headers).status_code == 403
+        monkeypatch.setattr(auth, "admin_user_ids", {user.id})
+        response = client.get("/admin/slow-queries", headers=headers)
+    finally:
+        query_log.reset()
+
+    assert response.status_code == 200
+    assert response.json()["queries"][0]["statement"] == "SELECT a FROM t"
@@ -0,0 +1,164 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from backend.auth import _build_access_token
+from backend.entities import MessageInDB
+from backend.main import app
+from backend.realtime import Hub, get_broker
+from backend.routers.chats import chat_event_stream
+
+
+@pytest.fixture
+def hub():
+    hub = Hub(queue_size=2)
+    app.dependency_overrides[get_broker] = lambda: hub
+    yield hub
+
+
+def _wait_for_subscriber(hub, topic):
+    deadline = time.monotonic() + 5
+    while hub.subscriber_count(topic) == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_websocket_receives_new_messages(client, session, hub, chat):
+    token = _build_access_token(chat.owner).access_token
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with client.websocket_connect(f"/chats/{chat.id}/ws?token={token}") as ws:
+        _wait_for_subscriber(hub, f"chats/{chat.id}")
+        response = client.post(f"/chats/{chat.id}/messages",
+                               json={"text": "hello"}, headers=headers)
+        assert response.status_code == 201
+
+        assert ws.receive_json() == response.json()
+
+
+def test_websocket_rejects_invalid_token(client, hub, chat):
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect(f"/chats/{chat.id}/ws?token=bad") as ws:
+            ws.receive_json()
+    assert error.value.code == 1008
+
+
+def test_websocket_rejects_unknown_chat(client, hub, chat):
+    token = _build_access_token(chat.owner).access_token
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect(f"/chats/999/ws?token={token}") as ws:
+            ws.receive_json()
+    assert error.value.code == 1008
+
+
+def test_hub_drops_slow_subscriber():
+    async def scenario():
+        hub = Hub(queue_size=2)
+        async with hub.subscribe("chats/1") as slow, \
+                hub.subscribe("chats/1") as fast:
+            received = []
+            for i in range(3):
+                await hub.publish("chats/1", {"n": i})
+                received.append(await fast.__anext__())
+
+            assert [m["n"] for m in received] == [0, 1, 2]
+            assert slow.dropped
+            assert [m async for m in slow] == []
+            assert hub.dropped_subscribers == 1
+
+        assert hub.subscriber_count("chats/1") == 0
+
+    asyncio.run(scenario())
+
+
+
+def test_sse_resumes_from_last_event_id(session, chat):
+    messages = [MessageInDB(text=f"message {i}", user_id=chat.owner_id,
+                            chat_id=chat.id) for i in range(4)]
+    session.add_all(messages)
+    session.commit()
+    hub = Hub()
+
+    async def scenario():
+        stream = chat_event_stream(chat.id, messages[1].id, session, hub)
+        assert await stream.__anext__() == "retry: 3000\n\n"
+        backlog = [await stream.__anext__() for _ in range(2)]
+        live = asyncio.ensure_future(stream.__anext__())
+        while hub.subscriber_count(f"chats/{chat.id}") == 0:
+            await asyncio.sleep(0)
+        # already replayed from the database, so it is not sent twice
+        await hub.publish(f"chats/{chat.id}", {"message": {"id": messages[3].id}})
+        await hub.publish(f"chats/{chat.id}", {"message": {"id": 999}})
+        event = await live
+        await stream.aclose()
+        return backlog, event
+
+    backlog, event = asyncio.run(scenario())
+    assert [event.split("\n")[0] for event in backlog] == [
+        f"id: {messages[2].id}", f"id: {messages[3].id}"]
+    assert '"text":"message 2"' in backlog[0]
+    assert event == 'id: 999\nevent: message\ndata: {"message":{"id":999}}\n\n'
+
+
+def test_sse_resumes_by_id_whatever_the_timestamps(session, chat):
+    # concurrent posts may commit the higher id with the older timestamp
+    messages = [MessageInDB(text=f"message {i}", user_id=chat.owner_id, chat_id=chat.id,
+                            created_at=datetime(2024, 1, 1, 0, 0, 2 - i)) for i in range(2)]
+    session.add_all(messages)
+    session.commit()
+
+    async def replay(last_event_id):
+        stream = chat_event_stream(chat.id, last_event_id, session, Hub())
+        assert await stream.__anext__() == "retry: 3000\n\n"
+        events = [await stream.__anext__()]
+        await stream.aclose()
+        return events[0].split("\n")[0]
+
+    assert asyncio.run(replay(messages[0].id)) == f"id: {messages[1].id}"
+    # an id that is no message of the chat is resumed from all the same
+    assert asyncio.run(replay(0)) == f"id: {messages[0].id}"
+
+
+def test_sse_delivers_live_messages_out_of_id_order(session, chat):
+    hub = Hub()
+
+    async def scenario():
+        stream = chat_event_stream(chat.id, None, session, hub)
+        assert await stream.__anext__() == "retry: 3000\n\n"
+        first = asyncio.ensure_future(stream.__anext__())
+        while hub.subscriber_count(f"chats/{chat.id}") == 0:
+            await asyncio.sleep(0)
+        # concurrent posts may commit, and so publish, in either order
+        await hub.publish(f"chats/{chat.id}", {"message": {"id": 11}})
+        await hub.publish(f"chats/{chat.id}", {"message": {"id": 10}})
+        events = [await first, await stream.__anext__()]
+        await stream.aclose()
+        return events
+
+    assert [event.split("\n")[0] for event in asyncio.run(scenario())] == ["id: 11", "id: 10"]
+
+
+def test_sse_sends_heartbeat_when_idle(session, chat):
+    async def scenario():
+        stream = chat_event_stream(chat.id, None, session, Hub(),
+                                   heartbeat_interval=0.01)
+        events = [await stream.__anext__() for _ in range(2)]
+        await stream.aclose()
+        return events
+
+    assert asyncio.run(scenario())[1] == ": heartbeat\n\n"
+
+
+def test_sse_requires_token(client, chat):
+    response = client.get(f"/chats/{chat.id}/events")
+    assert response.status_code == 401
+
+
+def test_sse_unknown_chat(client, chat):
+    token = _build_access_token(chat.owner).access_token
+    response = client.get("/chats/999/events",
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404
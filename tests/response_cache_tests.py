@@ -0,0 +1,279 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel
+
+from backend import database as db
+from backend import auth
+from backend.auth import _build_access_token
+from backend.cache import TTLCache
+from backend.entities import ChatInDB, UserInDB
+from backend.main import app
+from backend.response_cache import ResponseCache, create_backend, response_cache
+
+
+@pytest.fixture
+def seeded(session):
+    ripley = UserInDB(username="ripley", email="ripley@example.com", hashed_password="x")
+    dallas = UserInDB(username="dallas", email="dallas@example.com", hashed_password="x")
+    burke = UserInDB(username="burke", email="burke@example.com", hashed_password="x")
+    nostromo = ChatInDB(name="nostromo", owner=ripley, users=[ripley, dallas])
+    sulaco = ChatInDB(name="sulaco", owner=burke, users=[burke])
+    session.add_all([nostromo, sulaco])
+    session.commit()
+    return ripley, dallas, burke, nostromo, sulaco
+
+
+def _headers(user):
+    return {"Authorization": f"Bearer {_build_access_token(user).access_token}"}
+
+
+def _route_stats(route):
+    return response_cache.stats()["routes"].get(route, {"hits": 0, "misses": 0})
+
+
+@pytest.mark.parametrize("url, route", [
+    ("/users", "get_users"),
+    ("/users/{user_id}", "get_user"),
+    ("/chats", "get_chats"),
+    ("/chats/{chat_id}/users", "get_users_for_chat"),
+])
+def test_responses_are_cached(client, seeded, assert_num_queries, url, route):
+    ripley, _, _, nostromo, _ = seeded
+    # only the ETag lookup of the chat routes is left
+    expected = 1 if "{chat_id}" in url else 0
+    url = url.format(user_id=ripley.id, chat_id=nostromo.id)
+    first = client.get(url).json()
+
+    with assert_num_queries(expected):
+        assert client.get(url).json() == first
+    assert _route_stats(route) == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+def test_parameters_are_part_of_the_key(client, seeded):
+    assert [u["username"] for u in client.get("/users", params={"sort": "username"}).json()["users"]] == [
+        "burke", "dallas", "ripley"]
+    assert [u["username"] for u in client.get("/users", params={"fields": "username"}).json()["users"]] == [
+        "ripley", "dallas", "burke"]
+    assert client.get("/users", params={"fields": "id"}).json()["users"][0] == {"id": seeded[0].id}
+
+
+def test_user_update_invalidates_exactly_the_responses_showing_the_user(client, session, seeded):
+    ripley, dallas, burke, nostromo, sulaco = seeded
+    urls = {
+        "ripley": f"/users/{ripley.id}",
+        "burke": f"/users/{burke.id}",
+        "users": "/users",
+        "chats": "/chats",
+        "nostromo users": f"/chats/{nostromo.id}/users",
+        "sulaco users": f"/chats/{sulaco.id}/users",
+    }
+    for url in urls.values():
+        client.get(url)
+
+    invalidated = []
+    real_invalidate = response_cache.backend.invalidate_tags
+    response_cache.backend.invalidate_tags = lambda tags: invalidated.append(set(tags)) or real_invalidate(tags)
+    try:
+        response = client.put("/users/me", json={"username": "ellen"}, headers=_headers(ripley))
+    finally:
+        del response_cache.backend.invalidate_tags
+    assert response.status_code == 200
+    assert invalidated == [{f"user:{ripley.id}"}]
+
+    assert client.get(urls["ripley"]).json()["user"]["username"] == "ellen"
+    assert "ellen" in [u["username"] for u in client.get(urls["users"]).json()["users"]]
+    assert "ellen" in [c["owner"]["username"] for c in client.get(urls["chats"]).json()["chats"]]
+    assert "ellen" in [u["username"] for u in client.get(urls["nostromo users"]).json()["users"]]
+    hits = {route: _route_stats(route)["hits"] for route in ["get_user", "get_users_for_chat"]}
+    client.get(urls["burke"])
+    client.get(urls["sulaco users"])
+    assert _route_stats("get_user")["hits"] == hits["get_user"] + 1
+    assert _route_stats("get_users_for_chat")["hits"] == hits["get_users_for_chat"] + 1
+
+
+def test_chat_update_invalidates_chat_lists(client, seeded):
+    _, _, _, nostromo, _ = seeded
+    client.get("/chats")
+    client.get(f"/chats/{nostromo.id}/users")
+
+    client.put(f"/chats/{nostromo.id}", json={"name": "narcissus"})
+
+    assert "narcissus" in [c["name"] for c in client.get("/chats").json()["chats"]]
+    # the rename bumps the chat's version, which is part of the key
+    client.get(f"/chats/{nostromo.id}/users")
+    assert _route_stats("get_users_for_chat") == {"hits": 0, "misses": 2, "hit_ratio": 0.0}
+
+
+def test_membership_changes_invalidate_chat_users(client, session, seeded):
+    _, dallas, burke, nostromo, _ = seeded
+    client.get(f"/chats/{nostromo.id}/users")
+
+    nostromo.users.remove(dallas)
+    burke.chats.append(nostromo)
+    session.commit()
+
+    users = client.get(f"/chats/{nostromo.id}/users").json()["users"]
+    assert sorted(u["username"] for u in users) == ["burke", "ripley"]
+
+
+def test_chat_users_follow_the_etag_without_invalidation(client, session, seeded, monkeypatch):
+    _, dallas, _, nostromo, _ = seeded
+    before = client.get(f"/chats/{nostromo.id}/users")
+
+    # as seen by a worker that did not make the change
+    monkeypatch.setattr(response_cache, "invalidate", lambda tags: None)
+    nostromo.users.remove(dallas)
+    session.commit()
+
+    after = client.get(f"/chats/{nostromo.id}/users")
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert [u["username"] for u in after.json()["users"]] == ["ripley"]
+
+
+def test_registration_invalidates_user_lists(client, seeded, monkeypatch):
+    monkeypatch.setattr(auth, "admin_user_ids", {seeded[0].id})
+    client.get("/users")
+    client.post("/auth/registration", json={
+        "username": "ash", "email": "ash@example.com", "password": "secret"})
+    client.post("/auth/registration/bulk", json={"users": [
+        {"username": "kane", "email": "kane@example.com"}]}, headers=_headers(seeded[0]))
+
+    usernames = [u["username"] for u in client.get("/users").json()["users"]]
+    assert {"ash", "kane"} <= set(usernames)
+
+
+def test_new_messages_invalidate_nothing(client, session, seeded, monkeypatch):
+    ripley, _, _, nostromo, _ = seeded
+    invalidated = []
+    monkeypatch.setattr(response_cache, "invalidate", lambda tags: invalidated.append(set(tags)))
+
+    client.post(f"/chats/{nostromo.id}/messages", json={"text": "a"}, headers=_headers(ripley))
+    client.post(f"/chats/{nostromo.id}/messages:batch", json=[{"text": "b"}], headers=_headers(ripley))
+
+    # no cached response shows messages
+    assert invalidated == []
+
+
+def test_rolled_back_writes_emit_nothing(session, seeded, monkeypatch):
+    ripley = seeded[0]
+    invalidated = []
+    monkeypatch.setattr(response_cache, "invalidate", lambda tags: invalidated.append(set(tags)))
+
+    ripley.username = "ellen"
+    session.flush()
+    session.rollback()
+    seeded[3].name = "narcissus"
+    session.commit()
+
+    assert invalidated == [{f"chat:{seeded[3].id}"}]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("anyio_backend", ["asyncio"])
+async def test_values_loaded_before_a_write_are_not_cached(anyio_backend):
+    cache = ResponseCache(TTLCache(max_size=10, ttl=60))
+
+    async def load_during_write():
+        cache.invalidate(["user:1"])  # a write commits while the response is loaded
+        return "stale", ["user:1"]
+
+    async def load():
+        return "fresh", ["user:1"]
+
+    assert await cache.get_or_load("get_user", (1,), load_during_write) == "stale"
+    assert await cache.get_or_load("get_user", (1,), load) == "fresh"
+    assert await cache.get_or_load("get_user", (1,), load_during_write) == "fresh"
+
+
+class DictBackend(TTLCache):
+    """Stands in for an external store."""
+
+
+def make_dict_backend():
+    return DictBackend(max_size=10, ttl=60)
+
+
+def test_backend_is_pluggable():
+    assert type(create_backend("tests.response_cache_tests:make_dict_backend")) is DictBackend
+    assert type(create_backend("memory")) is TTLCache
+
+
+def test_admin_caches_report_hit_ratio_per_route(client, seeded, monkeypatch):
+    monkeypatch.setattr(auth, "admin_user_ids", {seeded[0].id})
+    client.get("/users")
+    client.get("/users")
+    stats = client.get("/admin/caches", headers=_headers(seeded[0])).json()["responses"]
+    assert stats["routes"]["get_users"]["hit_ratio"] == 0.5
+
+
+def test_no_stale_reads_after_writes_under_load(tmp_path):
+    """
+    Readers hammer the cached routes while a writer renames a user. A read
+    started after a rename returned must never show an older name.
+    """
+    engine = db.create_db_engine(f"sqlite:///{tmp_path / 'stress.db'}", pragmas=db.sqlite_pragmas)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = UserInDB(username="name0", email="user@example.com", hashed_password="x")
+        chat = ChatInDB(name="chat", owner=user, users=[user])
+        session.add(chat)
+        session.commit()
+        user_id, chat_id = user.id, chat.id
+        headers = _headers(user)
+
+    def get_session():
+        with Session(engine) as session:
+            yield session
+
+    urls = {
+        f"/users/{user_id}": lambda body: [body["user"]["username"]],
+        "/users": lambda body: [u["username"] for u in body["users"]],
+        f"/chats/{chat_id}/users": lambda body: [u["username"] for u in body["users"]],
+        "/chats": lambda body: [c["owner"]["username"] for c in body["chats"]],
+    }
+    renames = 60
+    committed = [0]
+    done = threading.Event()
+    errors = []
+
+    def writer():
+        client = TestClient(app)
+        try:
+            for i in range(1, renames + 1):
+                client.put("/users/me", json={"username": f"name{i}"}, headers=headers).raise_for_status()
+                committed[0] = i
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def reader():
+        client = TestClient(app)
+        try:
+            while not done.is_set():
+                for url, usernames in urls.items():
+                    floor = committed[0]
+                    seen = [int(name.removeprefix("name")) for name in usernames(client.get(url).json())]
+                    if min(seen) < floor:
+                        errors.append(f"{url} showed name{min(seen)} after name{floor} was committed")
+        except Exception as e:
+            errors.append(e)
+
+    app.dependency_overrides[db.get_session] = get_session
+    try:
+        # one request first, so that the threads do not race to import the event loop backend
+        TestClient(app).get("/").raise_for_status()
+        threads = [threading.Thread(target=reader) for _ in range(4)] + [threading.Thread(target=writer)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        app.dependency_overrides.clear()
+        engine.dispose()
+
+    assert errors == []
+    routes = response_cache.stats()["routes"]
+    assert all(routes[route]["hits"] > 0 for route in ["get_user", "get_users", "get_chats", "get_users_for_chat"])
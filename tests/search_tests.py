@@ -0,0 +1,165 @@
+from datetime import datetime
+
+import pytest
+from sqlmodel import SQLModel, create_engine
+
+from backend.auth import _build_access_token
+from backend.entities import ChatInDB, MessageInDB, UserInDB
+from backend.migrations import run_migrations
+from tests.conftest import capture_queries
+
+
+@pytest.fixture
+def crew():
+    return ["ripley"]
+
+
+@pytest.fixture
+def seeded(session, chat):
+    nostromo, ripley = chat, chat.owner
+    burke = UserInDB(username="burke", email="burke@example.com", hashed_password="x")
+    sulaco = ChatInDB(name="sulaco", owner=burke, users=[ripley, burke])
+    company = ChatInDB(name="company", owner=burke, users=[burke])
+    session.add_all([sulaco, company])
+    session.commit()
+    for i, (chat, text) in enumerate([
+        (nostromo, "the alien is in the air ducts"),
+        (nostromo, "set the self-destruct sequence"),
+        (nostromo, "Aliens, aliens everywhere: <run>"),
+        (sulaco, "we are going to find the aliens"),
+        (sulaco, "check the motion tracker"),
+        (company, "bring back an alien specimen"),
+    ]):
+        session.add(MessageInDB(text=text, user_id=ripley.id, chat_id=chat.id,
+                                created_at=datetime(2024, 1, 1, i)))
+    session.commit()
+    headers = {"Authorization": f"Bearer {_build_access_token(ripley).access_token}"}
+    return nostromo, sulaco, company, headers
+
+
+def _texts(response):
+    assert response.status_code == 200
+    return [message["text"] for message in response.json()["messages"]]
+
+
+def test_search_chat_messages(client, seeded):
+    nostromo, _, _, _ = seeded
+    response = client.get(f"/chats/{nostromo.id}/messages/search", params={"q": "alien"})
+
+    # stemmed, so "aliens" matches; the message mentioning it twice ranks first
+    assert _texts(response) == ["Aliens, aliens everywhere: <run>", "the alien is in the air ducts"]
+    scores = [message["score"] for message in response.json()["messages"]]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_search_requires_every_word(client, seeded):
+    nostromo, _, _, _ = seeded
+    response = client.get(f"/chats/{nostromo.id}/messages/search", params={"q": "alien ducts"})
+    assert _texts(response) == ["the alien is in the air ducts"]
+
+
+def test_search_highlights_are_escaped(client, seeded):
+    nostromo, _, _, _ = seeded
+    response = client.get(f"/chats/{nostromo.id}/messages/search", params={"q": "everywhere"})
+
+    highlight = response.json()["messages"][0]["highlight"]
+    assert "<mark>everywhere</mark>" in highlight
+    assert "&lt;run&gt;" in highlight and "<run>" not in highlight
+
+
+def test_search_is_paged(client, seeded):
+    _, _, _, headers = seeded
+    texts, offset = [], 0
+    while offset is not None:
+        response = client.get("/search/messages", params={"q": "alien", "limit": 1, "offset": offset},
+                              headers=headers)
+        texts += _texts(response)
+        offset = response.json()["meta"]["next_offset"]
+
+    assert len(texts) == 3
+
+
+def test_search_messages_is_limited_to_own_chats(client, seeded):
+    _, _, _, headers = seeded
+    response = client.get("/search/messages", params={"q": "alien"}, headers=headers)
+
+    assert sorted(_texts(response)) == [
+        "Aliens, aliens everywhere: <run>",
+        "the alien is in the air ducts",
+        "we are going to find the aliens",
+    ]
+
+
+def test_search_messages_requires_token(client, seeded):
+    assert client.get("/search/messages", params={"q": "alien"}).status_code == 401
+
+
+@pytest.mark.parametrize("q", ["AND", "NEAR(alien ducts)", '"alien', "alien*"])
+def test_search_query_syntax_is_not_interpreted(client, seeded, q):
+    nostromo, _, _, _ = seeded
+    response = client.get(f"/chats/{nostromo.id}/messages/search", params={"q": q})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("q", ["", "?!", "x" * 201])
+def test_search_invalid_query(client, seeded, q):
+    nostromo, _, _, _ = seeded
+    response = client.get(f"/chats/{nostromo.id}/messages/search", params={"q": q})
+    assert response.status_code == 422
+
+
+def test_search_unknown_chat(client, seeded):
+    response = client.get("/chats/999/messages/search", params={"q": "alien"})
+    assert response.status_code == 404
+
+
+def test_search_index_follows_updates_and_deletes(client, session, seeded):
+    nostromo, _, _, _ = seeded
+    url = f"/chats/{nostromo.id}/messages/search"
+    message = session.get(MessageInDB, client.get(url, params={"q": "ducts"}).json()["messages"][0]["id"])
+
+    message.text = "the creature is in the vents"
+    session.commit()
+    assert _texts(client.get(url, params={"q": "ducts"})) == []
+    assert _texts(client.get(url, params={"q": "vents"})) == ["the creature is in the vents"]
+
+    session.delete(message)
+    session.commit()
+    assert _texts(client.get(url, params={"q": "vents"})) == []
+
+
+def test_search_uses_the_full_text_index(client, session, seeded):
+    nostromo, _, _, headers = seeded
+    engine = session.get_bind()
+    with capture_queries(engine) as queries:
+        client.get(f"/chats/{nostromo.id}/messages/search", params={"q": "alien"})
+        client.get("/search/messages", params={"q": "alien"}, headers=headers)
+
+    statements = [(statement, parameters) for statement, parameters in queries
+                  if "FROM messages_fts" in statement or "@@" in statement]
+    assert len(statements) == 2
+    if engine.dialect.name == "sqlite":
+        connection = session.connection()
+        for statement, parameters in statements:
+            plan = [row[-1] for row in connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            assert any("VIRTUAL TABLE INDEX" in step for step in plan), plan
+
+
+def test_migration_indexes_existing_messages():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # a database from before the search index
+        for trigger in ["messages_fts_insert", "messages_fts_delete", "messages_fts_update"]:
+            connection.exec_driver_sql(f"DROP TRIGGER {trigger}")
+        connection.exec_driver_sql("DROP TABLE messages_fts")
+        connection.exec_driver_sql(
+            "INSERT INTO messages (text, user_id, chat_id, created_at) "
+            "VALUES ('an old message', 1, 1, '2024-01-01')")
+
+    run_migrations(engine)
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'old'").all()
+    assert len(rows) == 1
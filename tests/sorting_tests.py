@@ -0,0 +1,125 @@
+import re
+from datetime import datetime
+
+import pytest
+
+from backend import database as db
+from backend.entities import ChatInDB, MessageInDB, UserInDB
+from backend.routers import chats as chats_router_module
+from backend.routers import users as users_router_module
+from tests.conftest import capture_queries
+
+
+@pytest.fixture
+def seeded(session):
+    users = [UserInDB(username=name, email=f"{email}@example.com", hashed_password="x")
+             for name, email in [("ripley", "b"), ("ash", "c"), ("dallas", "a")]]
+    chats = [ChatInDB(name=name, owner=users[0], users=users, created_at=datetime(2024, 1, 1))
+             for name in ["nostromo", "engineering", "bridge"]]
+    session.add_all(chats)
+    session.commit()
+    for i, chat in enumerate([chats[1], chats[0], chats[2], chats[1]]):
+        session.add(MessageInDB(text=f"message {i}", user_id=users[i % 3].id,
+                                chat_id=chat.id, created_at=datetime(2024, 1, 2, i)))
+    session.commit()
+    return users, chats
+
+
+@pytest.mark.parametrize("url, key, sort, order, expected", [
+    ("/users", "users", None, None, ["ripley", "ash", "dallas"]),
+    ("/users", "users", "username", "asc", ["ash", "dallas", "ripley"]),
+    ("/users", "users", "email", "desc", ["ash", "ripley", "dallas"]),
+    ("/chats", "chats", None, None, ["bridge", "engineering", "nostromo"]),
+    ("/chats", "chats", "name", "desc", ["nostromo", "engineering", "bridge"]),
+    ("/chats", "chats", "id", "asc", ["nostromo", "engineering", "bridge"]),
+    ("/chats/{chat_id}/users", "users", None, None, ["ripley", "ash", "dallas"]),
+    ("/chats/{chat_id}/users", "users", "username", "desc", ["ripley", "dallas", "ash"]),
+    ("/users/{user_id}/chats", "chats", None, None, ["engineering", "bridge", "nostromo"]),
+    ("/users/{user_id}/chats", "chats", "last_activity", "asc", ["nostromo", "bridge", "engineering"]),
+    ("/users/{user_id}/chats", "chats", "name", "asc", ["bridge", "engineering", "nostromo"]),
+])
+def test_collections_are_sorted(client, seeded, url, key, sort, order, expected):
+    users, chats = seeded
+    params = {name: value for name, value in [("sort", sort), ("order", order)] if value}
+    response = client.get(url.format(chat_id=chats[0].id, user_id=users[0].id), params=params)
+
+    assert response.status_code == 200
+    field = "username" if key == "users" else "name"
+    assert [item[field] for item in response.json()[key]] == expected
+
+
+def test_messages_can_be_listed_newest_first(client, seeded):
+    users, chats = seeded
+    url = f"/chats/{chats[1].id}/messages"
+
+    response = client.get(url, params={"order": "desc", "limit": 1})
+    assert [m["text"] for m in response.json()["messages"]] == ["message 3"]
+    cursor = response.json()["meta"]["next_cursor"]
+    response = client.get(url, params={"order": "desc", "before": cursor})
+    assert [m["text"] for m in response.json()["messages"]] == ["message 0"]
+
+    response = client.get(url, params={"order": "asc"})
+    assert [m["text"] for m in response.json()["messages"]] == ["message 0", "message 3"]
+
+
+def test_chat_include_messages_is_sorted(client, session):
+    user = UserInDB(username="ripley", email="ripley@example.com", hashed_password="x")
+    chat = ChatInDB(name="nostromo", owner=user, users=[user])
+    session.add(chat)
+    session.commit()
+    # inserted out of order
+    for hour in [3, 1, 2]:
+        session.add(MessageInDB(text=f"at {hour}", user_id=user.id, chat_id=chat.id,
+                                created_at=datetime(2024, 1, 1, hour)))
+    session.commit()
+    chat_id = chat.id
+    session.expunge_all()
+
+    response = client.get(f"/chats/{chat_id}", params={"include": "messages"})
+    assert [m["text"] for m in response.json()["messages"]] == ["at 1", "at 2", "at 3"]
+
+
+@pytest.mark.parametrize("url, params", [
+    ("/users", {"sort": "hashed_password"}),
+    ("/chats", {"order": "sideways"}),
+    ("/chats/{chat_id}/users", {"sort": "email"}),
+    ("/chats/{chat_id}/messages", {"sort": "text"}),
+    ("/users/{user_id}/chats", {"sort": "owner"}),
+])
+def test_sort_outside_allow_list_is_rejected(client, seeded, url, params):
+    users, chats = seeded
+    response = client.get(url.format(chat_id=chats[0].id, user_id=users[0].id), params=params)
+
+    assert response.status_code == 422
+    assert response.json()["detail"]["type"] == "invalid_sort"
+
+
+def test_sorting_happens_in_sql(client, session, seeded, monkeypatch):
+    users, chats = seeded
+
+    def no_python_sort(*args, **kwargs):
+        raise AssertionError("sorted in python")
+
+    for module in [db, chats_router_module, users_router_module]:
+        monkeypatch.setattr(module, "sorted", no_python_sort, raising=False)
+
+    urls = [
+        "/users",
+        "/chats",
+        f"/chats/{chats[0].id}?include=messages&include=users",
+        f"/chats/{chats[0].id}/messages",
+        f"/chats/{chats[0].id}/users",
+        f"/users/{users[0].id}/chats",
+    ]
+    session.expunge_all()
+    with capture_queries(session.get_bind()) as queries:
+        for url in urls:
+            assert client.get(url).status_code == 200
+
+    # everything but single-row lookups by primary key must be ordered
+    lookup = re.compile(r"WHERE \w+\.id = \?\s*$")
+    selects = [statement for statement, _ in queries
+               if statement.startswith("SELECT") and not lookup.search(statement)]
+    assert len(selects) >= len(urls)
+    for statement in selects:
+        assert "ORDER BY" in statement, statement
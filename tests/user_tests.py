@@ -1,5 +1,9 @@
+from datetime import datetime
+
 from fastapi.testclient import TestClient
 
+from backend.auth import _build_access_token
+from backend.entities import ChatInDB, MessageInDB, UserInDB
 from backend.main import app
 
 client = TestClient(app)
@@ -87,3 +91,66 @@ def test_get_user_chats_invalid_id():
     invalid_user_id = "invalid_id"
     response = client.get(f"/users/{invalid_user_id}/chats")
     assert response.status_code == 404
+
+
+def _seed_chats(session, quiet):
+    # nostromo stays quiet while sulaco gets messages
+    ripley, dallas = quiet.users
+    quiet.created_at = datetime(2024, 1, 1)
+    busy = ChatInDB(name="sulaco", owner=dallas, users=[ripley, dallas],
+                    created_at=datetime(2024, 1, 1))
+    session.add_all([quiet, busy])
+    session.commit()
+    for i, author in enumerate([dallas, dallas, ripley, dallas]):
+        session.add(MessageInDB(text=f"busy {i}", user_id=author.id, chat_id=busy.id,
+                                created_at=datetime(2024, 1, 2, i)))
+    session.commit()
+    return ripley, quiet, busy
+
+
+def test_get_user_chats_with_previews_and_unread_counts(client, session, chat, assert_num_queries):
+    ripley, quiet, busy = _seed_chats(session, chat)
+    user_id = ripley.id
+
+    # the user, then the chats with their previews and unread counts
+    with assert_num_queries(2):
+        response = client.get(f"/users/{user_id}/chats")
+
+    assert response.status_code == 200
+    chats = response.json()["chats"]
+    # most recently active first, not by name
+    assert [chat["name"] for chat in chats] == ["sulaco", "nostromo"]
+    assert chats[0]["last_message"]["text"] == "busy 3"
+    assert chats[0]["last_message"]["user"]["username"] == "dallas"
+    # ripley's own message is never unread
+    assert chats[0]["unread_count"] == 3
+    assert chats[1]["last_message"] is None
+    assert chats[1]["unread_count"] == 0
+
+
+def test_read_cursor_clears_unread_count(client, session, chat):
+    ripley, quiet, busy = _seed_chats(session, chat)
+    headers = {"Authorization": f"Bearer {_build_access_token(ripley).access_token}"}
+    message_ids = [message.id for message in sorted(busy.messages, key=lambda m: m.id)]
+
+    response = client.put(f"/chats/{busy.id}/read", json={"message_id": message_ids[1]}, headers=headers)
+    assert response.status_code == 204
+    chats = client.get(f"/users/{ripley.id}/chats").json()["chats"]
+    assert chats[0]["unread_count"] == 1
+
+    client.put(f"/chats/{busy.id}/read", json={"message_id": message_ids[3]}, headers=headers)
+    # an older position does not mark messages unread again
+    client.put(f"/chats/{busy.id}/read", json={"message_id": message_ids[0]}, headers=headers)
+    chats = client.get(f"/users/{ripley.id}/chats").json()["chats"]
+    assert chats[0]["unread_count"] == 0
+
+    response = client.put(f"/chats/{quiet.id}/read", json={"message_id": message_ids[0]}, headers=headers)
+    assert response.status_code == 404
+
+    burke = UserInDB(username="burke", email="burke@example.com", hashed_password="x")
+    session.add(burke)
+    session.commit()
+    headers = {"Authorization": f"Bearer {_build_access_token(burke).access_token}"}
+    response = client.put(f"/chats/{busy.id}/read", json={"message_id": message_ids[0]}, headers=headers)
+    assert response.status_code == 404
+    assert response.json()["detail"]["entity_name"] == "Chat"